@@ -1,14 +1,49 @@
 # LLM_Suitcase_server.py
-from fastapi import FastAPI
+import threading
+import functools
+import itertools
+import hashlib
+import asyncio
+import string
+import queue
+import time
+import re
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaGrammar
 from fastapi.middleware.cors import CORSMiddleware
-from config import LLM_CONFIG
+from config import (LLM_CONFIG, PREFIX_CACHE_SIZE, SCORE_REASONING_MAX_CHARS, LLM_QUEUE_SIZE,
+                    LLM_REQUEST_TIMEOUT, prompt_template)
 
 # --------- Define the request model ---------
+# score_parameter turns on scoring mode: generation stops right after "[{score_parameter}: X]"
+# and the parsed X is returned as "score". use_grammar additionally constrains the output
+# to a single short reasoning line followed by that tag.
+# Lower priority values run first (fresh posts ahead of backfill), timeout is in seconds.
+# With text set, prompt holds the TEXT_PLACEHOLDER where the (possibly truncated) text is inserted.
 class PromptRequest(BaseModel):
     prompt: str
+    text: Optional[str] = None
     max_tokens: int = 256
+    score_parameter: Optional[str] = None
+    use_grammar: bool = False
+    priority: int = 1
+    timeout: Optional[float] = None
+
+class BatchPromptRequest(BaseModel):
+    prompts: List[str]
+    texts: Optional[List[str]] = None
+    max_tokens: int = 256
+    score_parameter: Optional[str] = None
+    use_grammar: bool = False
+    priority: int = 1
+    timeout: Optional[float] = None
+
+class PrefixRequest(BaseModel):
+    prefix: str
 
 # --------- Initialize FastAPI ---------
 app = FastAPI(title="Mistral API")
@@ -25,19 +60,286 @@ app.add_middleware(
 # --------- Initialize your Mistral model ---------
 llm = Llama(**LLM_CONFIG)
 
+# --------- Prefix KV cache ---------
+def static_prefix(template: str) -> str:
+    """Literal text of a str.format template up to its first placeholder."""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        parts.append(literal)
+        if field is not None:
+            break
+    return "".join(parts)
+
+class PrefixCache:
+    """
+    Saved llama states of evaluated static prompt prefixes (e.g. the instructions part of
+    prompt_template), keyed by sha256 of the prefix text, LRU-bounded because every state
+    holds a copy of the KV cache.
+
+    Llama.generate already skips the part of a prompt shared with the previous one, so the
+    saved state is only loaded when the live context does not start with the prefix anymore
+    (first request, a prompt with another head, a truncated context...).
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max(1, max_entries)
+        self.states = OrderedDict()  # sha256 -> (prefix tokens, LlamaState)
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, prefix: str):
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        if key in self.states:
+            self.states.move_to_end(key)
+            return key
+        tokens = llm.tokenize(prefix.encode("utf-8"), add_bos=True)
+        llm.reset()
+        llm.eval(tokens)
+        self.states[key] = (tokens, llm.save_state())
+        while len(self.states) > self.max_entries:
+            self.states.popitem(last=False)
+        return key
+
+    def restore(self, prompt: str):
+        prompt_tokens = llm.tokenize(prompt.encode("utf-8"), add_bos=True)
+        # Only the first n_tokens of input_ids are in the KV cache, the rest of the buffer is stale
+        live = Llama.longest_token_prefix(llm.input_ids[:llm.n_tokens].tolist(), prompt_tokens)
+        for key, (tokens, state) in reversed(self.states.items()):
+            shared = Llama.longest_token_prefix(tokens, prompt_tokens)
+            if shared < len(tokens) - 1:
+                continue  # Allow the last token to merge differently with the text after it
+            self.states.move_to_end(key)
+            if live < shared:
+                llm.load_state(state)  # Context lost the prefix, restore it instead of re-evaluating
+            self.hits += 1
+            return
+        self.misses += 1
+
+    def stats(self):
+        return {"entries": len(self.states), "hits": self.hits, "misses": self.misses}
+
+prefix_cache = PrefixCache(PREFIX_CACHE_SIZE)
+prefix_cache.register(static_prefix(prompt_template))  # Before the consumer thread exists, nothing else uses llm yet
+
+# --------- Prompt budget ---------
+TEXT_PLACEHOLDER = "{text}"
+OMITTED_MARKER = "\n[...]\n"
+SAFETY_TOKENS = 16  # Detokenized head/tail can re-tokenize slightly differently
+_link = re.compile(r"\[[^\]]*\]\([^)\s]+\)|https?://\S+|t\.me/\S+|@\w{4,}")
+
+def count_tokens(text: str) -> int:
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+def truncate_text(text: str, budget: int) -> str:
+    """
+    Fit text into budget tokens: keep its head (2/3) and tail (1/3), and every link,
+    mention or Markdown link from the cut middle, since those decide most ad verdicts.
+    """
+    tokens = llm.tokenize(text.encode("utf-8"), add_bos=False)
+    if len(tokens) <= budget:
+        return text
+
+    links = list(dict.fromkeys(_link.findall(text)))
+    links_budget = budget // 3
+    kept, used = [], 0
+    for link in links:
+        cost = count_tokens(" " + link)
+        if used + cost > links_budget:
+            break
+        kept.append(link)
+        used += cost
+
+    remaining = max(0, budget - used - count_tokens(OMITTED_MARKER) - count_tokens("\n[links: ]"))
+    head_n = remaining * 2 // 3
+    tail_n = remaining - head_n
+    head = llm.detokenize(tokens[:head_n]).decode("utf-8", errors="ignore")
+    tail = llm.detokenize(tokens[-tail_n:]).decode("utf-8", errors="ignore") if tail_n else ""
+    cut = [link for link in kept if link not in head and link not in tail]
+
+    result = head + OMITTED_MARKER + tail
+    if cut:
+        result += "\n[links: " + " ".join(cut) + "]"
+    return result
+
+def fit_prompt(prompt: str, text: Optional[str], max_tokens: int) -> str:
+    """Insert text into the prompt's placeholder, truncated so prompt and answer fit into n_ctx."""
+    if text is None:
+        return prompt
+    frame = prompt.replace(TEXT_PLACEHOLDER, "", 1)
+    budget = llm.n_ctx() - count_tokens(frame) - max_tokens - SAFETY_TOKENS
+    return prompt.replace(TEXT_PLACEHOLDER, truncate_text(text, max(budget, 0)), 1)
+
+# --------- Scoring mode ---------
+@functools.lru_cache(maxsize=None)
+def score_pattern(score_parameter: str):
+    return re.compile(fr"\[{re.escape(score_parameter)}:\s*(\d+)\]")
+
+@functools.lru_cache(maxsize=None)
+def score_grammar(score_parameter: str) -> LlamaGrammar:
+    tag = score_parameter.replace("\\", "\\\\").replace('"', '\\"')
+    return LlamaGrammar.from_string(f'''
+root      ::= reasoning "\\n[{tag}: " score "]"
+reasoning ::= [^\\n\\[]{{1,{int(SCORE_REASONING_MAX_CHARS)}}}
+score     ::= [0-9] | [1-9] [0-9] | "100"
+''', verbose=False)
+
+def run_prompt(prompt: str, max_tokens: int, score_parameter: Optional[str] = None, use_grammar: bool = False,
+               stop: Optional[threading.Event] = None):
+    """
+    Generate a response for prompt, returns (text, score).
+    In scoring mode the stream is closed as soon as the score tag is complete, which stops decoding.
+    Setting stop (the request timed out) also ends generation after the current token.
+    """
+    prefix_cache.restore(prompt)
+    grammar = score_grammar(score_parameter) if score_parameter and use_grammar else None
+    pattern = score_pattern(score_parameter) if score_parameter else None
+    window = len(score_parameter) + 16 if score_parameter else 0
+
+    chunks = []
+    tail = ""
+    score = None
+    stream = llm(prompt=prompt, max_tokens=max_tokens, stream=True, grammar=grammar)
+    try:
+        for chunk in stream:
+            if stop is not None and stop.is_set():
+                break
+            piece = chunk["choices"][0]["text"]
+            chunks.append(piece)
+            if pattern:
+                tail = (tail + piece)[-window:]  # the tag can only end in the newest text
+                match = pattern.search(tail)
+                if match:
+                    score = int(match.group(1))
+                    break
+    finally:
+        stream.close()
+    return "".join(chunks), score
+
+# --------- Inference queue ---------
+class InferenceJob:
+    def __init__(self, fn, timeout):
+        self.fn = fn                        # called with a stop Event on the consumer thread
+        self.deadline = time.monotonic() + timeout
+        self.future = Future()
+        self.stop = threading.Event()
+
+class InferenceQueue:
+    """
+    Priority queue of model calls with a single consumer thread, the only thread that touches llm.
+
+    submit() raises queue.Full instead of waiting, so overload is rejected right away. Jobs whose
+    deadline passed while queued are dropped without running, and a running job stops generating
+    once its stop event is set.
+    """
+
+    def __init__(self, max_size):
+        self.queue = queue.PriorityQueue(maxsize=max_size)
+        self.seq = itertools.count()        # FIFO among equal priorities
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.consumer = threading.Thread(target=self._consume, daemon=True, name="llm-consumer")
+        self.consumer.start()
+
+    def submit(self, fn, priority, timeout):
+        job = InferenceJob(fn, timeout)
+        try:
+            self.queue.put_nowait((priority, next(self.seq), job))
+        except queue.Full:
+            self.rejected += 1
+            raise
+        return job
+
+    def _consume(self):
+        while True:
+            _, _, job = self.queue.get()
+            if not job.future.set_running_or_notify_cancel():
+                self.expired += 1           # Caller gave up while it was queued
+                continue
+            if job.stop.is_set() or time.monotonic() > job.deadline:
+                self.expired += 1
+                job.future.set_exception(TimeoutError("request expired in the queue"))
+                continue
+            try:
+                job.future.set_result(job.fn(job.stop))
+                self.completed += 1
+            except Exception as e:
+                job.future.set_exception(e)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "max_size": self.queue.maxsize,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+inference_queue = InferenceQueue(LLM_QUEUE_SIZE)
+
+async def run_queued(fn, priority: int = 0, timeout: Optional[float] = None):
+    """Run fn(stop) on the model thread, 429 when the queue is full and 504 after timeout seconds."""
+    timeout = timeout or LLM_REQUEST_TIMEOUT
+    try:
+        job = inference_queue.submit(fn, priority, timeout)
+    except queue.Full:
+        raise HTTPException(status_code=429, detail="LLM queue is full", headers={"Retry-After": "5"})
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(job.future), timeout)
+    except (asyncio.TimeoutError, TimeoutError):
+        job.stop.set()  # Cancelled while queued, or stops generating if already running
+        raise HTTPException(status_code=504, detail="LLM request timed out")
+
 # --------- API Endpoints ---------
 @app.get("/")
 def read_root():
     return {"message": "Mistral API is running."}
 
 @app.post("/generate")
-def generate_text(request: PromptRequest):
-    prompt = request.prompt
-    max_tokens = request.max_tokens
+async def generate_text(request: PromptRequest):
+    def job(stop):
+        prompt = fit_prompt(request.prompt, request.text, request.max_tokens)
+        return run_prompt(prompt, request.max_tokens, request.score_parameter, request.use_grammar, stop)
+
+    response_text, score = await run_queued(job, request.priority, request.timeout)
+    return {"response": response_text, "score": score}
+
+@app.post("/prefix")
+async def register_prefix(request: PrefixRequest):
+    """Pre-evaluate and keep a static prompt prefix, e.g. the head of another prompt template."""
+    key = await run_queued(lambda stop: prefix_cache.register(request.prefix), priority=0)
+    return {"status": "ok", "prefix_hash": key}
+
+@app.get("/prefix_stats")
+def prefix_stats():
+    return prefix_cache.stats()
+
+@app.get("/queue_stats")
+def queue_stats():
+    return inference_queue.stats()
+
+@app.post("/generate_batch")
+async def generate_batch(request: BatchPromptRequest):
+    """
+    Run many prompts in one request, responses come back in request order.
 
-    # Generate response
-    response_text = ""
-    for chunk in llm(prompt=prompt, max_tokens=max_tokens, stream=True):
-        response_text += chunk["choices"][0]["text"]
+    llama-cpp-python decodes a single sequence per context, so prompts run back to back
+    as one queued job. They are ordered so neighbours share the longest prompt prefix:
+    Llama.generate keeps the KV cache of the previous prompt and only evaluates the part
+    after the common prefix (for scoring prompts that is everything after the template head).
+    """
+    def job(stop):
+        texts = request.texts or [None] * len(request.prompts)
+        prompts = [fit_prompt(prompt, text, request.max_tokens) for prompt, text in zip(request.prompts, texts)]
+        order = sorted(range(len(prompts)), key=lambda i: prompts[i])
+        responses = [""] * len(prompts)
+        scores = [None] * len(prompts)
+        for i in order:
+            if stop.is_set():
+                break
+            responses[i], scores[i] = run_prompt(prompts[i], request.max_tokens,
+                                                 request.score_parameter, request.use_grammar, stop)
+        return responses, scores
 
-    return {"response": response_text}
+    responses, scores = await run_queued(job, request.priority, request.timeout)
+    return {"responses": responses, "scores": scores}
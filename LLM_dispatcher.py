@@ -0,0 +1,193 @@
+# LLM_dispatcher.py
+# Runs LLM_WORKERS copies of LLM_Suitcase_server.py as separate processes, each pinned to its own CPU cores,
+# behind a dispatcher with the same API on llm_port. Only used by the launcher when LLM_WORKERS > 1.
+import os
+import asyncio
+import multiprocessing
+import httpx
+import uvicorn
+from fastapi import FastAPI, Body, HTTPException
+from fastapi.responses import JSONResponse
+import config
+
+
+def worker_cores(workers: int):
+    """
+    Split the CPUs this process may run on into `workers` contiguous groups, or use LLM_WORKER_CORES.
+    Returns None on platforms without CPU affinity.
+    """
+    if config.LLM_WORKER_CORES:
+        return [list(cores) for cores in config.LLM_WORKER_CORES]
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    size, extra = divmod(len(cpus), workers)
+    groups, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cpus[start:end] or cpus)
+        start = end
+    return groups
+
+
+def run_worker(port: int, cores):
+    """Process entry point: pin to cores, give llama one thread per core (generation and prompt evaluation) and serve one model instance."""
+    if cores:
+        os.sched_setaffinity(0, cores)  # Inherited by llama's threads
+        config.LLM_CONFIG["n_threads"] = len(cores)
+        config.LLM_CONFIG["n_threads_batch"] = len(cores)  # Defaults to every core of the machine otherwise
+    from LLM_Suitcase_server import app as llm_app  # Loads the model, the GGUF is mmapped and shared through the page cache
+    uvicorn.run(llm_app, host="127.0.0.1", port=port, reload=False, log_level="critical")
+
+
+def start_workers(workers=config.LLM_WORKERS, base_port=config.LLM_WORKER_BASE_PORT):
+    """Start the worker processes, returns their base URLs."""
+    ctx = multiprocessing.get_context("spawn")  # Fresh interpreters, nothing of the parent is inherited
+    groups = worker_cores(workers)
+    urls = []
+    for i in range(workers):
+        port = base_port + i
+        cores = groups[i] if groups else None
+        ctx.Process(target=run_worker, args=(port, cores), daemon=True, name=f"llm-worker-{i}").start()
+        print(f"LLM worker {i} on port {port}, cores {cores if cores else 'any'}")
+        urls.append(f"http://127.0.0.1:{port}")
+    return urls
+
+
+class WorkerPool:
+    """
+    Tracks how many prompts each worker is running and routes new work to the least-loaded ones.
+    """
+
+    def __init__(self, urls):
+        self.urls = urls
+        self.load = [0] * len(urls)         # prompts in flight per worker
+        self.served = [0] * len(urls)
+        self.next = 0                       # tie breaker, rotates between equally loaded workers
+        self.client = None
+
+    def pick(self, count):
+        """Indexes of the `count` least-loaded workers."""
+        n = len(self.urls)
+        order = sorted(range(n), key=lambda i: (self.load[i], (i - self.next) % n))
+        self.next = (self.next + 1) % n
+        return order[:count]
+
+    async def post(self, worker, path, payload, weight=1):
+        self.load[worker] += weight
+        try:
+            response = await self.client.post(self.urls[worker] + path, json=payload)
+            if response.status_code != 200:
+                # Pass 429 (queue full) and 504 (timeout) of the worker through to the caller
+                raise HTTPException(status_code=response.status_code, detail=response.text,
+                                    headers={"Retry-After": response.headers.get("Retry-After", "5")})
+            return response.json()
+        finally:
+            self.load[worker] -= weight
+            self.served[worker] += weight
+
+
+pool = WorkerPool([])
+dispatcher = FastAPI(title="Mistral API dispatcher")
+
+# Request bodies are passed through as they are, the workers validate them
+# (importing the request models from LLM_Suitcase_server would load the model here too).
+
+
+@dispatcher.on_event("startup")
+async def open_client():
+    pool.client = httpx.AsyncClient(timeout=None)
+
+
+@dispatcher.on_event("shutdown")
+async def close_client():
+    await pool.client.aclose()
+
+
+@dispatcher.get("/")
+async def read_root():
+    """Up only when every worker has loaded its model."""
+    for url in pool.urls:
+        try:
+            (await pool.client.get(url + "/", timeout=2.0)).raise_for_status()
+        except Exception:
+            return JSONResponse(status_code=503, content={"message": f"LLM worker {url} is not ready."})
+    return {"message": f"Mistral API is running on {len(pool.urls)} workers."}
+
+
+@dispatcher.post("/generate")
+async def generate_text(request: dict = Body(...)):
+    worker = pool.pick(1)[0]
+    return await pool.post(worker, "/generate", request)
+
+
+@dispatcher.post("/generate_batch")
+async def generate_batch(request: dict = Body(...)):
+    """
+    Split the batch over the least-loaded workers. Prompts are sorted first and every worker gets a
+    contiguous slice, so neighbouring prompts still share their prefix inside each worker.
+    """
+    prompts = request.get("prompts", [])
+    order = sorted(range(len(prompts)), key=lambda i: prompts[i])
+    workers = pool.pick(min(len(pool.urls), len(order)))
+    size, extra = divmod(len(order), len(workers)) if workers else (0, 0)
+    slices, start = [], 0
+    for n in range(len(workers)):
+        end = start + size + (1 if n < extra else 0)
+        slices.append(order[start:end])
+        start = end
+
+    texts = request.get("texts")
+
+    def sub_request(part):
+        sub = {**request, "prompts": [prompts[i] for i in part]}
+        if texts is not None:
+            sub["texts"] = [texts[i] for i in part]
+        return sub
+
+    results = await asyncio.gather(*(
+        pool.post(worker, "/generate_batch", sub_request(part), weight=len(part))
+        for worker, part in zip(workers, slices)
+    ))
+
+    responses = [""] * len(prompts)
+    scores = [None] * len(prompts)
+    for part, result in zip(slices, results):
+        for i, response, score in zip(part, result["responses"], result["scores"]):
+            responses[i], scores[i] = response, score
+    return {"responses": responses, "scores": scores}
+
+
+@dispatcher.post("/prefix")
+async def register_prefix(request: dict = Body(...)):
+    """Every worker keeps its own KV state, so the prefix is registered on all of them."""
+    results = await asyncio.gather(*(pool.post(i, "/prefix", request) for i in range(len(pool.urls))))
+    return results[0] if results else {"status": "error"}
+
+
+@dispatcher.get("/prefix_stats")
+async def prefix_stats():
+    return {"workers": [(await pool.client.get(url + "/prefix_stats")).json() for url in pool.urls]}
+
+
+@dispatcher.get("/queue_stats")
+async def queue_stats():
+    """Queues of all workers, with the counters summed up in total."""
+    stats = [(await pool.client.get(url + "/queue_stats")).json() for url in pool.urls]
+    total = {key: sum(s.get(key, 0) for s in stats) for key in (stats[0] if stats else {})}
+    return {"total": total, "workers": stats}
+
+
+@dispatcher.get("/workers")
+async def workers():
+    return {"workers": [
+        {"url": url, "in_flight": pool.load[i], "served": pool.served[i]} for i, url in enumerate(pool.urls)
+    ]}
+
+
+def run_dispatcher(host=config.llm_ipaddress, port=config.llm_port, workers=config.LLM_WORKERS):
+    """Start the workers and serve the dispatcher, blocks like uvicorn.run."""
+    pool.urls = start_workers(workers)
+    pool.load = [0] * len(pool.urls)
+    pool.served = [0] * len(pool.urls)
+    uvicorn.run(dispatcher, host=host, port=port, reload=False, log_level="critical")
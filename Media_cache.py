@@ -0,0 +1,159 @@
+# Media_cache.py
+import os
+import time
+import sqlite3
+import threading
+from collections import Counter
+import config
+
+
+class MediaCache:
+    """
+    Content-addressed store for reloaded media, keyed by Telegram file_unique_id.
+
+    Files live under root/<first two characters of the id>/<file_unique_id><extension>, so the same
+    photo cross-posted by several tracked channels is downloaded once and names never collide.
+    The index is a SQLite file holding size and last use of every file, plus the file_id of our own
+    upload of it in TARGET_CHANNEL, which lets re-sends skip both the download and the upload.
+    When the files grow past max_bytes the least recently used ones are deleted, except files
+    pinned by lookup()/add(pin=True) for a send that is still using them (see unpin()).
+    """
+
+    def __init__(self, root=config.MEDIA_CACHE_DIR, path=config.MEDIA_CACHE_INDEX_PATH,
+                 max_bytes=config.MEDIA_CACHE_MAX_BYTES):
+        self.root = os.path.abspath(root)   # Pyrogram resolves relative download paths against the script dir
+        self.max_bytes = max_bytes
+        self.upload_hits = 0
+        self.file_hits = 0
+        self.misses = 0
+        self.pinned = Counter()             # file_unique_id -> sends using its file right now
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                file_unique_id TEXT PRIMARY KEY,
+                path TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                file_id TEXT,
+                last_used REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_media_last_used ON media (last_used)")
+        self._conn.commit()
+
+    def path_for(self, unique_id: str, file_name: str) -> str:
+        """Where the file of unique_id is stored, keeps the extension of file_name for the upload."""
+        ext = os.path.splitext(file_name)[1]
+        directory = os.path.join(self.root, unique_id[:2])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, unique_id + ext)
+
+    def lookup(self, unique_id: str):
+        """
+        Return (path, file_id) for a file_unique_id, either may be None.
+        file_id is the one of our earlier upload and can be sent as is.
+        A returned path is pinned until unpin() is called for it.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, file_id FROM media WHERE file_unique_id = ?", (unique_id,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None, None
+            path, file_id = row
+            if path and not os.path.isfile(path):
+                path = None
+            if file_id:
+                self.upload_hits += 1
+            elif path:
+                self.file_hits += 1
+                self.pinned[unique_id] += 1
+            else:
+                self.misses += 1
+            with self._conn:
+                self._conn.execute("UPDATE media SET last_used = ? WHERE file_unique_id = ?", (time.time(), unique_id))
+            return path, file_id
+
+    def store(self, unique_id: str, file_name: str, data: bytes) -> str:
+        """Write an in-memory download to the store, returns its path."""
+        path = self.path_for(unique_id, file_name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)   # Concurrent stores of the same file just replace each other
+        self.add(unique_id, path)
+        return path
+
+    def add(self, unique_id: str, path: str, pin: bool = False):
+        """Index a file already placed at path_for(unique_id, ...), pin it when it is about to be sent."""
+        size = os.path.getsize(path)
+        with self._lock, self._conn:
+            if pin:
+                self.pinned[unique_id] += 1
+            self._conn.execute("""
+                INSERT INTO media (file_unique_id, path, size, last_used) VALUES (?, ?, ?, ?)
+                ON CONFLICT(file_unique_id) DO UPDATE SET path = excluded.path, size = excluded.size,
+                                                          last_used = excluded.last_used
+            """, (unique_id, path, size, time.time()))
+            self._evict()
+
+    def unpin(self, unique_ids):
+        """The sends using these files are done, they can be evicted again."""
+        with self._lock:
+            for unique_id in unique_ids:
+                self.pinned[unique_id] -= 1
+                if self.pinned[unique_id] <= 0:
+                    del self.pinned[unique_id]
+
+    def remember_upload(self, unique_id: str, file_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO media (file_unique_id, file_id, last_used) VALUES (?, ?, ?)
+                ON CONFLICT(file_unique_id) DO UPDATE SET file_id = excluded.file_id
+            """, (unique_id, file_id, time.time()))
+
+    def forget_uploads(self, unique_ids):
+        """Drop stored file_ids, e.g. after Telegram refused one of them, so the next attempt uploads again."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE media SET file_id = NULL WHERE file_unique_id = ?", [(u,) for u in unique_ids]
+            )
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop down to 90% at once, so eviction does not run on every download
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute(
+            "SELECT file_unique_id, path, size FROM media WHERE size > 0 ORDER BY last_used ASC"
+        ).fetchall()
+        for unique_id, path, size in rows:
+            if total <= target:
+                break
+            if unique_id in self.pinned:
+                continue  # Being uploaded right now
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            # The file_id of the upload stays usable without the local copy
+            self._conn.execute("UPDATE media SET path = NULL, size = 0 WHERE file_unique_id = ?", (unique_id,))
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media").fetchone()
+        lookups = self.upload_hits + self.file_hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "upload_hits": self.upload_hits,
+            "file_hits": self.file_hits,
+            "misses": self.misses,
+            "hit_rate": (self.upload_hits + self.file_hits) / lookups if lookups else 0.0,
+        }
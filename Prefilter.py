@@ -0,0 +1,170 @@
+# Prefilter.py
+import os
+import re
+import json
+import math
+import time
+import threading
+import config
+
+# Outcomes of a pre-classifier
+CLEAN = "clean"   # definitely not an ad, score 0 without the LLM
+AD = "ad"         # definitely an ad, score 100 without the LLM
+ASK = "ask"       # ambiguous, the LLM decides
+
+OUTCOME_SCORES = {CLEAN: 0, AD: 100}
+
+FEATURES = (
+    "text_links", "urls", "mentions", "custom_emoji", "hashtags",
+    "phones", "bot_links", "keywords", "length",
+)
+
+_bot_link = re.compile(r"t\.me/\w+bot\b|[?&]start=", re.IGNORECASE)
+_raw_link = re.compile(r"https?://|t\.me/|www\.", re.IGNORECASE)
+
+
+def _keyword_pattern(keywords=config.PREFILTER_AD_KEYWORDS):
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(k.casefold()) for k in keywords))
+
+
+_keywords = _keyword_pattern()
+
+
+def _entities(entities_raw):
+    if not entities_raw:
+        return []
+    if isinstance(entities_raw, list):
+        return entities_raw
+    try:
+        return json.loads(entities_raw)
+    except ValueError:
+        return []
+
+
+def extract_features(message: dict) -> dict:
+    """
+    Cheap numeric features of a pending message (raw text and its entities).
+    Counts are log-scaled so one message with many links does not dominate the linear model.
+    """
+    text = message.get("text") or ""
+    counts = dict.fromkeys(FEATURES, 0)
+    urls = []
+    for e in _entities(message.get("messages_entities")):
+        kind = str(e.get("type", "")).replace("MessageEntityType.", "")
+        if kind == "TEXT_LINK":
+            counts["text_links"] += 1
+            urls.append(e.get("url") or "")
+        elif kind == "URL":
+            counts["urls"] += 1
+        elif kind in ("MENTION", "TEXT_MENTION"):
+            counts["mentions"] += 1
+        elif kind == "CUSTOM_EMOJI":
+            counts["custom_emoji"] += 1
+        elif kind in ("HASHTAG", "CASHTAG"):
+            counts["hashtags"] += 1
+        elif kind == "PHONE_NUMBER":
+            counts["phones"] += 1
+    if not counts["urls"]:
+        # Entities may be missing for stored edits, fall back to the raw text
+        counts["urls"] = len(_raw_link.findall(text))
+    counts["bot_links"] = len(_bot_link.findall(text)) + sum(1 for u in urls if _bot_link.search(u))
+    if _keywords is not None:
+        counts["keywords"] = len(_keywords.findall(text.casefold()))
+
+    features = {name: math.log1p(value) for name, value in counts.items()}
+    features["length"] = min(len(text) / 1000, 2.0)
+    return features
+
+
+class LinearPrefilter:
+    """
+    Logistic model over extract_features() with two thresholds on its probability:
+    below clean_below the message is CLEAN, above ad_above it is AD, in between ASK.
+
+    Weights and thresholds come from the calibration file written by Prefilter_calibration.py.
+    Without one every message is ASK, so nothing is decided on uncalibrated guesses.
+    """
+
+    def __init__(self, path=config.PREFILTER_CALIBRATION_PATH):
+        self.weights = {}
+        self.bias = 0.0
+        self.clean_below = None
+        self.ad_above = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                calibration = json.load(f)
+            self.weights = calibration["weights"]
+            self.bias = calibration["bias"]
+            self.clean_below = calibration.get("clean_below")
+            self.ad_above = calibration.get("ad_above")
+            print(f"Pre-filter calibration loaded from {path}: "
+                  f"clean below {self.clean_below}, ad above {self.ad_above}")
+        else:
+            print(f"No pre-filter calibration at {path}, every message goes to the LLM")
+
+    def probability(self, features: dict) -> float:
+        z = self.bias + sum(self.weights.get(name, 0.0) * value for name, value in features.items())
+        return 1 / (1 + math.exp(-max(-50.0, min(50.0, z))))
+
+    def __call__(self, message: dict) -> str:
+        if self.clean_below is None and self.ad_above is None:
+            return ASK
+        p = self.probability(extract_features(message))
+        if self.clean_below is not None and p < self.clean_below:
+            return CLEAN
+        if self.ad_above is not None and p > self.ad_above:
+            return AD
+        return ASK
+
+
+# Pre-classifiers by name, config.PREFILTER picks one. Each is a factory returning
+# a callable that takes a pending message dict and returns CLEAN, AD or ASK.
+PREFILTERS = {
+    "LINEAR": LinearPrefilter,
+}
+
+
+def register_prefilter(name, factory):
+    PREFILTERS[name] = factory
+
+
+class PrefilterStage:
+    """Runs the configured pre-classifier and counts its outcomes and time per message."""
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.counts = dict.fromkeys((CLEAN, AD, ASK), 0)
+        self.total_time = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, message: dict) -> str:
+        started = time.perf_counter()
+        try:
+            outcome = self.classifier(message)
+        except Exception as e:
+            print(f"Error in pre-filter: {e}")
+            outcome = ASK
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.counts[outcome] += 1
+            self.total_time += elapsed
+        return outcome
+
+    def stats(self):
+        total = sum(self.counts.values())
+        return {
+            **self.counts,
+            "decided": (self.counts[CLEAN] + self.counts[AD]) / total if total else 0.0,
+            "avg_us": self.total_time / total * 1e6 if total else 0.0,
+        }
+
+
+def create_prefilter(name=config.PREFILTER):
+    """PrefilterStage for the named pre-classifier, or None when name is empty."""
+    if not name:
+        return None
+    if name not in PREFILTERS:
+        raise ValueError(f"Unknown pre-filter {name!r}, known: {', '.join(PREFILTERS)}")
+    return PrefilterStage(PREFILTERS[name]())
@@ -0,0 +1,121 @@
+# Prefilter_calibration.py
+# Fits the LINEAR pre-filter on historical LLM verdicts (messages.llm_score) and writes PREFILTER_CALIBRATION_PATH.
+# Run with the DB server up: python Prefilter_calibration.py
+import json
+import math
+import random
+import requests
+import config
+from Prefilter import FEATURES, extract_features
+
+DB_API = f"http://{config.database_ipaddress}:{config.database_port}"
+MIN_DECIDED = 20  # smallest group a threshold may be based on
+
+
+def fetch_scored(user_id, limit):
+    response = requests.get(f"{DB_API}/scored/{user_id}?limit={limit}")
+    response.raise_for_status()
+    return response.json().get("messages", [])
+
+
+def fit_logistic(samples, epochs=300, learning_rate=0.5, l2=1e-3):
+    """Batch gradient descent on (features, label) pairs, returns (weights, bias)."""
+    weights = dict.fromkeys(FEATURES, 0.0)
+    bias = 0.0
+    n = len(samples)
+    for _ in range(epochs):
+        grad = dict.fromkeys(FEATURES, 0.0)
+        grad_bias = 0.0
+        for features, label in samples:
+            z = bias + sum(weights[k] * v for k, v in features.items())
+            error = 1 / (1 + math.exp(-max(-50.0, min(50.0, z)))) - label
+            for k, v in features.items():
+                grad[k] += error * v
+            grad_bias += error
+        for k in weights:
+            weights[k] -= learning_rate * (grad[k] / n + l2 * weights[k])
+        bias -= learning_rate * grad_bias / n
+    return weights, bias
+
+
+def pick_thresholds(scored, max_error):
+    """
+    scored: (probability, label) pairs of held-out messages.
+    clean_below is the largest cut with at most max_error ads under it,
+    ad_above the smallest cut with at most max_error clean messages above it.
+    """
+    scored = sorted(scored)
+    clean_below = None
+    ads = 0
+    for i, (p, label) in enumerate(scored):
+        ads += label
+        size = i + 1
+        if size >= MIN_DECIDED and ads / size <= max_error and (size == len(scored) or scored[i + 1][0] > p):
+            clean_below = (p + scored[i + 1][0]) / 2 if size < len(scored) else p + 1e-9
+    ad_above = None
+    cleans = 0
+    for i, (p, label) in enumerate(reversed(scored)):
+        cleans += 1 - label
+        size = i + 1
+        j = len(scored) - size
+        if size >= MIN_DECIDED and cleans / size <= max_error and (j == 0 or scored[j - 1][0] < p):
+            ad_above = (p + scored[j - 1][0]) / 2 if j > 0 else p - 1e-9
+    if clean_below is not None and ad_above is not None and ad_above < clean_below:
+        ad_above = clean_below  # The two ranges must not overlap
+    return clean_below, ad_above
+
+
+def evaluate(scored, clean_below, ad_above):
+    decided = wrong = 0
+    for p, label in scored:
+        if clean_below is not None and p < clean_below:
+            decided += 1
+            wrong += label
+        elif ad_above is not None and p > ad_above:
+            decided += 1
+            wrong += 1 - label
+    return decided / len(scored), (wrong / decided if decided else 0.0)
+
+
+def main():
+    rows = fetch_scored(config.user_id, config.PREFILTER_CALIBRATION_LIMIT)
+    rows = [r for r in rows if r.get("text")]
+    if len(rows) < config.PREFILTER_MIN_SAMPLES:
+        print(f"Only {len(rows)} scored messages, need {config.PREFILTER_MIN_SAMPLES} to calibrate")
+        return
+
+    samples = [(extract_features(r), 1 if r["llm_score"] >= config.Scoring_messaging_gap else 0) for r in rows]
+    random.Random(0).shuffle(samples)
+    split = int(len(samples) * 0.8)
+    train, holdout = samples[:split], samples[split:]
+
+    weights, bias = fit_logistic(train)
+
+    def probability(features):
+        z = bias + sum(weights[k] * v for k, v in features.items())
+        return 1 / (1 + math.exp(-max(-50.0, min(50.0, z))))
+
+    scored = [(probability(features), label) for features, label in holdout]
+    clean_below, ad_above = pick_thresholds(scored, config.PREFILTER_MAX_ERROR)
+    coverage, error = evaluate(scored, clean_below, ad_above)
+
+    with open(config.PREFILTER_CALIBRATION_PATH, "w", encoding="utf-8") as f:
+        json.dump({
+            "weights": weights,
+            "bias": bias,
+            "clean_below": clean_below,
+            "ad_above": ad_above,
+            "samples": len(samples),
+            "scoring_messaging_gap": config.Scoring_messaging_gap,
+            "holdout_coverage": coverage,
+            "holdout_error": error,
+        }, f, indent=2)
+
+    print(f"Calibrated on {len(train)} messages, checked on {len(holdout)}")
+    print(f"clean below {clean_below}, ad above {ad_above}")
+    print(f"Held-out: {coverage:.0%} decided without the LLM, {error:.1%} of those disagree with it")
+    print(f"Saved to {config.PREFILTER_CALIBRATION_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,67 @@
 from fastapi import FastAPI, Body
 from pydantic import BaseModel
 from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+import asyncio
 import sqlite3
+import time
+import config
 #import SQLite_database
 
 # Rename the FastAPI instance
 tg_database = FastAPI(title="TeleMessageHub")  # <-- custom name for uvicorn
 
+DB_PATH = config.DB_PATH
+
+# --------- Connection manager ---------
+# One connection per thread, opened on first use and kept for the lifetime of the server,
+# so every thread reuses its own prepared statement cache (cached_statements) instead of reconnecting per request.
+_connections = {}  # thread id -> connection
+_connections_lock = threading.Lock()
+
+def get_connection():
+    conn = _connections.get(threading.get_ident())
+    if conn is None:
+        # check_same_thread=False only so shutdown can close it, each connection is used by its own thread
+        conn = sqlite3.connect(DB_PATH, cached_statements=config.DB_STATEMENT_CACHE_SIZE, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, fsync only on checkpoint
+        conn.execute(f"PRAGMA cache_size=-{int(config.DB_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size={int(config.DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=5000")
+        with _connections_lock:
+            _connections[threading.get_ident()] = conn
+    return conn
+
+# --------- Async access ---------
+# SQLite has a single writer anyway, so every write runs on one dedicated writer thread and
+# writes never compete for the lock. Reads run on a small pool of reader threads, WAL lets them
+# proceed while a write commits. Endpoints await both, the event loop itself never touches sqlite3.
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_readers = ThreadPoolExecutor(max_workers=config.DB_READ_THREADS, thread_name_prefix="db-reader")
+
+async def run_write(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_writer, fn, *args)
+
+async def run_read(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_readers, fn, *args)
+
+def db_write(fn):
+    """Turn a blocking endpoint into an async one executed on the writer thread."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_write(functools.partial(fn, *args, **kwargs))
+    return wrapper
+
+def db_read(fn):
+    """Turn a blocking endpoint into an async one executed on a reader thread."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_read(functools.partial(fn, *args, **kwargs))
+    return wrapper
+
 # Pydantic model for input
 class MessageInput(BaseModel):
     message_id: str
@@ -42,6 +97,35 @@ class UpdateCheckTracking(BaseModel):
 
 class FilterRequest(BaseModel):
     message_id: str
+    owner: str                                  # lease owner acking the message
+
+class ClaimRequest(BaseModel):
+    owner: str                                  # worker id, e.g. host:pid
+    limit: int = 10
+    lease_seconds: float = config.LEASE_SECONDS
+
+class RenewRequest(BaseModel):
+    owner: str
+    message_ids: List[str]
+    lease_seconds: float = config.LEASE_SECONDS
+
+class ReleaseRequest(BaseModel):
+    owner: str
+    message_ids: List[str]
+    retry_after: float = 0                      # seconds before the messages can be claimed again
+
+class ScoreRecord(BaseModel):
+    message_id: str
+    score: int
+
+class PublishedRecord(BaseModel):
+    message_id: str             # source message
+    target_channel_id: str
+    target_message_id: str = ""  # empty when nothing was created in the target channel
+
+class PublishedRequest(BaseModel):
+    owner: str                                  # lease owner acking the messages
+    records: List[PublishedRecord]
 
 class UpdatesPayload(BaseModel):
     user_id: str
@@ -49,9 +133,63 @@ class UpdatesPayload(BaseModel):
     unknown: List[EditedMessage] = []
     edited: List[EditedMessage] = []
 
-@tg_database.on_event("startup")
-def create_tables():
-    conn = sqlite3.connect("messages.db")
+# --------- Schema migrations ---------
+# Applied in order on startup after the base tables exist, PRAGMA user_version stores
+# the last applied version. Append new migrations, never edit one that was released.
+MIGRATIONS = [
+    (1, "indexes for processing, update status, edits and tracking lookups", [
+        # /processing: pending messages of a channel in id order, the partial index only holds new/edited rows
+        """CREATE INDEX IF NOT EXISTS idx_messages_pending
+           ON messages (user_id, channel_id, id)
+           WHERE status IN ('new', 'edited')""",
+        # /update_status: latest messages of a channel by date, covering
+        """CREATE INDEX IF NOT EXISTS idx_messages_channel_date
+           ON messages (user_id, channel_id, message_date, message_id, message_media_group_id, message_edit_date)""",
+        # /apply_updates: match by media group, or by message id for single messages
+        """CREATE INDEX IF NOT EXISTS idx_messages_channel_group
+           ON messages (channel_id, message_media_group_id, message_id)""",
+        # /tracking_check: source message -> target message, covering
+        """CREATE INDEX IF NOT EXISTS idx_message_links_source
+           ON message_links (user_id, channel_id, message_id, target_channel_id, target_message_id)""",
+    ]),
+    (2, "llm_score column with the LLM verdict of each scored message", [
+        "ALTER TABLE messages ADD COLUMN llm_score INTEGER",
+        # /scored: history of LLM verdicts for pre-filter calibration
+        """CREATE INDEX IF NOT EXISTS idx_messages_scored
+           ON messages (user_id, id)
+           WHERE llm_score IS NOT NULL""",
+    ]),
+    (3, "leases on pending messages for claim/ack/retry", [
+        "ALTER TABLE messages ADD COLUMN lease_owner TEXT",
+        "ALTER TABLE messages ADD COLUMN lease_expires_at REAL",
+        "ALTER TABLE messages ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (4, "one row per source message, pushed and polled copies of a post are stored once", [
+        # Keep the first copy of messages stored twice before the index existed
+        """DELETE FROM messages
+           WHERE id NOT IN (SELECT MIN(id) FROM messages GROUP BY user_id, channel_id, message_id)""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_source
+           ON messages (user_id, channel_id, message_id)""",
+    ]),
+]
+
+def run_migrations(conn):
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN")
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied DB migration {version}: {description}")
+
+def create_base_tables(conn):
     c = conn.cursor()
     # Create table with pairs
     c.execute("""
@@ -86,48 +224,88 @@ def create_tables():
             )
         """)
     conn.commit()
-    conn.close()
+    c.close()
+
+@tg_database.on_event("startup")
+@db_write
+def create_tables():
+    conn = get_connection()
+    # WAL lets readers run while a write commits, the setting is stored in the DB file
+    conn.execute("PRAGMA journal_mode=WAL")
+    create_base_tables(conn)
+    run_migrations(conn)
+
+@tg_database.on_event("shutdown")
+def close_connections():
+    with _connections_lock:
+        for conn in _connections.values():
+            conn.close()
+        _connections.clear()
+
+# Messages already stored (idx_messages_source) are skipped, so concurrent ingestion paths never store a post twice
+INSERT_MESSAGE_SQL = """
+    INSERT OR IGNORE INTO messages (
+        message_id, message_media_group_id, user_id, channel_id, message_media, message_date, 
+        message_edit_date, message_forward_from, message_forward_from_chat, 
+        message_reply_to_message_id, messages_entities, text, status, is_protected
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def message_row(msg: MessageInput):
+    return (
+        msg.message_id,
+        getattr(msg, "message_media_group_id", None),
+        msg.user_id,
+        msg.channel_id,
+        getattr(msg, "message_media", None),
+        getattr(msg, "message_date", None),
+        getattr(msg, "message_edit_date", None),
+        getattr(msg, "message_forward_from", None),
+        getattr(msg, "message_forward_from_chat", None),
+        getattr(msg, "message_reply_to_message_id", None),
+        getattr(msg, "messages_entities", None),
+        msg.text,
+        msg.status,
+        msg.is_protected
+    )
 
 @tg_database.post("/messages/")
+@db_write
 def add_message(msg: MessageInput):
-    conn = sqlite3.connect("messages.db")
+    conn = get_connection()
     c = conn.cursor()
 
     # Insert new message including message_id
-    c.execute(
-        """
-        INSERT INTO messages (
-            message_id, message_media_group_id, user_id, channel_id, message_media, message_date, 
-            message_edit_date, message_forward_from, message_forward_from_chat, 
-            message_reply_to_message_id, messages_entities, text, status, is_protected
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            msg.message_id,
-            getattr(msg, "message_media_group_id", None),
-            msg.user_id,
-            msg.channel_id,
-            getattr(msg, "message_media", None),
-            getattr(msg, "message_date", None),
-            getattr(msg, "message_edit_date", None),
-            getattr(msg, "message_forward_from", None),
-            getattr(msg, "message_forward_from_chat", None),
-            getattr(msg, "message_reply_to_message_id", None),
-            getattr(msg, "messages_entities", None),
-            msg.text,
-            msg.status,
-            msg.is_protected
-        )
-    )
+    with conn:  # commit, or rollback on error
+        c.execute(INSERT_MESSAGE_SQL, message_row(msg))
+        inserted = c.rowcount
+    c.close()
+    return {"status": "success", "message": msg.text, "inserted": inserted}
+
+@tg_database.post("/messages/batch")
+@db_write
+def add_messages_batch(messages: List[MessageInput]):
+    conn = get_connection()
+    c = conn.cursor()
 
-    conn.commit()
-    conn.close()
-    return {"status": "success", "message": msg.text}
+    # Insert all messages in one transaction, so a batch costs one commit
+    try:
+        before = conn.total_changes
+        c.executemany(INSERT_MESSAGE_SQL, [message_row(msg) for msg in messages])
+        inserted = conn.total_changes - before  # Without the ignored duplicates
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return {"status": "error", "message": str(e)}
+    finally:
+        c.close()
+    return {"status": "success", "inserted": inserted}
 
 # Endpoint to get messages
 @tg_database.get("/messages/{user_id}/{channel_id}")
+@db_read
 def get_messages(user_id: int, channel_id: str, limit: int = 10):
-    conn = sqlite3.connect("messages.db")
+    conn = get_connection()
     c = conn.cursor()
     # Select all relevant columns including user_id and channel_id
     c.execute("""
@@ -142,7 +320,7 @@ def get_messages(user_id: int, channel_id: str, limit: int = 10):
     """, (user_id, channel_id, limit))
 
     rows = c.fetchall()
-    conn.close()
+    c.close()
 
     messages = [
         {
@@ -171,8 +349,9 @@ def get_messages(user_id: int, channel_id: str, limit: int = 10):
     }
 
 @tg_database.get("/update_status/{user_id}/{channel_id}")
+@db_read
 def get_update_status(user_id: int, channel_id: str, limit: int = 10):
-    conn = sqlite3.connect("messages.db")
+    conn = get_connection()
     c = conn.cursor()
     # Select only necessary columns with limit
     c.execute("""
@@ -184,7 +363,7 @@ def get_update_status(user_id: int, channel_id: str, limit: int = 10):
        """, (user_id, channel_id, limit))
 
     rows = c.fetchall()
-    conn.close()
+    c.close()
 
     updates = [
         {
@@ -199,46 +378,72 @@ def get_update_status(user_id: int, channel_id: str, limit: int = 10):
     return {"user_id": user_id, "channel_id": channel_id, "updates": updates}
 
 @tg_database.post("/apply_updates/")
-async def apply_updates(updates: UpdatesPayload):
+@db_write
+def apply_updates(updates: UpdatesPayload):
+    conn = get_connection()
+    c = conn.cursor()
     try:
-        conn = sqlite3.connect("messages.db")
-        c = conn.cursor()
+        apply_edited(c, updates)
+        conn.commit()
+        return {"status": "ok"}
 
-        for msg in updates.edited:
-            c.execute("""
-                UPDATE messages
-                SET message_edit_date = ?,
-                    text = ?,
-                    messages_entities = ?,
-                    status = 'edited'
-                WHERE channel_id = ?
-                  AND (
-                      (message_media_group_id IS NOT NULL AND message_media_group_id = ?)
-                      OR (message_media_group_id IS NULL AND message_id = ?)
-                  )
-            """, (
-                msg.message_edit_date,
-                msg.text,
-                msg.messages_entities,
-                updates.channel_id,
-                msg.message_media_group_id,
-                msg.message_id
-            ))
+    except Exception as e:
+        conn.rollback()
+        return {"status": "error", "message": str(e)}
+
+    finally:
+        c.close()
+
+@tg_database.post("/apply_updates/batch")
+@db_write
+def apply_updates_batch(payloads: List[UpdatesPayload]):
+    conn = get_connection()
+    c = conn.cursor()
 
+    # Edits of a whole ingestion sweep in one transaction
+    try:
+        for updates in payloads:
+            apply_edited(c, updates)
         conn.commit()
-        return {"status": "ok"}
+        return {"status": "ok", "channels": len(payloads)}
 
     except Exception as e:
+        conn.rollback()
         return {"status": "error", "message": str(e)}
 
     finally:
-        conn.close()
+        c.close()
+
+def apply_edited(c, updates: UpdatesPayload):
+    for msg in updates.edited:
+        # channel_id sits inside both branches so each one is an index search (MULTI-INDEX OR)
+        c.execute("""
+            UPDATE messages
+            SET message_edit_date = ?,
+                text = ?,
+                messages_entities = ?,
+                status = 'edited',
+                attempts = 0,
+                lease_owner = NULL,         -- A worker still holding the old version must not ack the edit
+                lease_expires_at = NULL
+            WHERE (channel_id = ? AND message_media_group_id IS NOT NULL AND message_media_group_id = ?)
+               OR (channel_id = ? AND message_media_group_id IS NULL AND message_id = ?)
+        """, (
+            msg.message_edit_date,
+            msg.text,
+            msg.messages_entities,
+            updates.channel_id,
+            msg.message_media_group_id,
+            updates.channel_id,
+            msg.message_id
+        ))
 
 @tg_database.get("/processing/{user_id}/{channel_id}")
+@db_read
 def get_messages_to_process(user_id: int, channel_id: str, limit: int = 10):
-    conn = sqlite3.connect("messages.db")
-    conn.row_factory = sqlite3.Row
+    conn = get_connection()
     c = conn.cursor()
+    c.row_factory = sqlite3.Row
 
     c.execute("""
             SELECT message_id, user_id, channel_id, messages_entities, text, status, is_protected
@@ -251,44 +456,191 @@ def get_messages_to_process(user_id: int, channel_id: str, limit: int = 10):
 
     rows = [dict(row) for row in c.fetchall()]
 
-    conn.close()
+    c.close()
     return {"messages": rows}
 
+# --------- Leases ---------
+# A worker claims pending messages by leasing them until lease_expires_at. Claimed messages are
+# invisible to other workers until the lease expires (the worker died) or is released (retry).
+# /filtering acks a message: its status leaves new/edited and the lease is cleared.
+# Messages claimed LEASE_MAX_ATTEMPTS times without an ack are moved to status 'failed'.
+
+@tg_database.post("/claim/{user_id}/{channel_id}")
+@db_write
+def claim_messages(user_id: int, channel_id: str, request: ClaimRequest):
+    conn = get_connection()
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    now = time.time()
+
+    # Runs on the single writer thread, and UPDATE ... RETURNING selects and leases in one statement
+    with conn:  # commit, or rollback on error
+        c.execute("""
+            UPDATE messages
+            SET status = 'failed', lease_owner = NULL, lease_expires_at = NULL
+            WHERE user_id = ? AND channel_id = ?
+              AND status IN ('new', 'edited')
+              AND attempts >= ?
+              AND (lease_expires_at IS NULL OR lease_expires_at <= ?)
+        """, (user_id, channel_id, config.LEASE_MAX_ATTEMPTS, now))
+        failed = c.rowcount
+        c.execute("""
+            UPDATE messages
+            SET lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM messages
+                WHERE user_id = ? AND channel_id = ?
+                  AND status IN ('new', 'edited')
+                  AND (lease_expires_at IS NULL OR lease_expires_at <= ?)
+                ORDER BY id ASC
+                LIMIT ?
+            )
+            RETURNING id, message_id, user_id, channel_id, messages_entities, text, status, is_protected, attempts,
+                      message_date, message_edit_date
+        """, (request.owner, now + request.lease_seconds, user_id, channel_id, now, request.limit))
+        rows = [dict(row) for row in c.fetchall()]
+    c.close()
+
+    if failed:
+        print(f"{failed} messages in {channel_id} failed {config.LEASE_MAX_ATTEMPTS} times, marked as failed")
+    rows.sort(key=lambda row: row.pop("id"))  # RETURNING order is not defined
+    return {"messages": rows}
+
+@tg_database.post("/renew/{user_id}/{channel_id}")
+@db_write
+def renew_messages(user_id: int, channel_id: str, request: RenewRequest):
+    """Extend leases held by request.owner, e.g. after scoring so they last until publishing acks them."""
+    conn = get_connection()
+    c = conn.cursor()
+    expires_at = time.time() + request.lease_seconds
+
+    with conn:  # commit, or rollback on error
+        c.executemany("""
+            UPDATE messages
+            SET lease_expires_at = ?
+            WHERE user_id = ? AND channel_id = ? AND message_id = ? AND lease_owner = ?
+              AND status IN ('new', 'edited')
+        """, [(expires_at, user_id, channel_id, message_id, request.owner) for message_id in request.message_ids])
+        renewed = c.rowcount
+    c.close()
+    return {"status": "ok", "renewed": renewed}
+
+@tg_database.post("/release/{user_id}/{channel_id}")
+@db_write
+def release_messages(user_id: int, channel_id: str, request: ReleaseRequest):
+    conn = get_connection()
+    c = conn.cursor()
+    retry_at = time.time() + request.retry_after if request.retry_after > 0 else None
+
+    with conn:  # commit, or rollback on error
+        c.executemany("""
+            UPDATE messages
+            SET lease_owner = NULL, lease_expires_at = ?
+            WHERE user_id = ? AND channel_id = ? AND message_id = ? AND lease_owner = ?
+        """, [(retry_at, user_id, channel_id, message_id, request.owner) for message_id in request.message_ids])
+        released = c.rowcount
+    c.close()
+    return {"status": "ok", "released": released}
+
 @tg_database.post("/filtering/{user_id}/{channel_id}")
-async def apply_filtering(user_id: int, channel_id: str, request: FilterRequest):
+@db_write
+def apply_filtering(user_id: int, channel_id: str, request: FilterRequest):
     message_id = request.message_id
-    conn = sqlite3.connect("messages.db")
-    conn.row_factory = sqlite3.Row
+    conn = get_connection()
     c = conn.cursor()
+    c.row_factory = sqlite3.Row
 
     try:
         c.execute("""
             UPDATE messages
-            SET status = 'filtered'
+            SET status = 'filtered', lease_owner = NULL, lease_expires_at = NULL
             WHERE user_id = ? AND channel_id = ? AND message_id = ?
-              AND status IN ('new', 'edited')
-        """, (user_id, channel_id, message_id))
+              AND status IN ('new', 'edited') AND lease_owner = ?
+        """, (user_id, channel_id, message_id, request.owner))
 
         if c.rowcount == 0:
+            conn.rollback()  # Do not leave the connection inside an open transaction
             return {"status": "error", "message missed or status changed for": message_id}
 
         conn.commit()
         return {"status": "ok", "filtered_message_id": message_id}
     finally:
-        conn.close()
-
-@tg_database.post("/tracking/{user_id}/{channel_id}")
-async def update_tracking(user_id: int, channel_id: str, request: UpdateTracking):
-    conn = sqlite3.connect("messages.db")
-    conn.row_factory = sqlite3.Row
+        c.close()
+
+@tg_database.post("/published/{user_id}/{channel_id}")
+@db_write
+def record_published(user_id: int, channel_id: str, request: PublishedRequest):
+    """/filtering plus /tracking for many messages of a channel, in one transaction."""
+    records = request.records
+    conn = get_connection()
     c = conn.cursor()
-    c.execute("""
+    filtered = []
+    with conn:  # commit, or rollback on error
+        for r in records:
+            c.execute("""
+                UPDATE messages
+                SET status = 'filtered', lease_owner = NULL, lease_expires_at = NULL
+                WHERE user_id = ? AND channel_id = ? AND message_id = ?
+                  AND status IN ('new', 'edited') AND lease_owner = ?
+            """, (user_id, channel_id, r.message_id, request.owner))
+            if c.rowcount:
+                filtered.append(r.message_id)
+        # Messages whose lease this caller lost belong to another worker now, it acks and tracks them
+        acked = set(filtered)
+        tracked = [r for r in records if r.target_message_id and r.message_id in acked]
+        c.executemany("""
             INSERT INTO message_links (user_id, channel_id, message_id, target_channel_id, target_message_id)
             VALUES (?, ?, ?, ?, ?)
-        """, (user_id, channel_id, request.message_id, request.target_channel_id, request.target_message_id))
+        """, [(user_id, channel_id, r.message_id, r.target_channel_id, r.target_message_id) for r in tracked])
+    c.close()
+    return {"status": "ok", "filtered": filtered, "tracked": len(tracked)}
+
+@tg_database.post("/scores/{user_id}/{channel_id}")
+@db_write
+def record_scores(user_id: int, channel_id: str, scores: List[ScoreRecord]):
+    conn = get_connection()
+    c = conn.cursor()
+    with conn:  # commit, or rollback on error
+        c.executemany("""
+            UPDATE messages
+            SET llm_score = ?
+            WHERE user_id = ? AND channel_id = ? AND message_id = ?
+        """, [(s.score, user_id, channel_id, s.message_id) for s in scores])
+    c.close()
+    return {"status": "ok", "recorded": len(scores)}
+
+@tg_database.get("/scored/{user_id}")
+@db_read
+def get_scored_messages(user_id: int, limit: int = 10000):
+    conn = get_connection()
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
 
-    conn.commit()
-    conn.close()
+    c.execute("""
+        SELECT message_id, channel_id, messages_entities, text, llm_score
+        FROM messages
+        WHERE user_id = ? AND llm_score IS NOT NULL
+        ORDER BY id DESC
+        LIMIT ?
+    """, (user_id, limit))
+
+    rows = [dict(row) for row in c.fetchall()]
+
+    c.close()
+    return {"messages": rows}
+
+@tg_database.post("/tracking/{user_id}/{channel_id}")
+@db_write
+def update_tracking(user_id: int, channel_id: str, request: UpdateTracking):
+    conn = get_connection()
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    with conn:  # commit, or rollback on error
+        c.execute("""
+                INSERT INTO message_links (user_id, channel_id, message_id, target_channel_id, target_message_id)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, channel_id, request.message_id, request.target_channel_id, request.target_message_id))
+    c.close()
 
     return {
         "status": "ok",
@@ -298,17 +650,18 @@ async def update_tracking(user_id: int, channel_id: str, request: UpdateTracking
     }
 
 @tg_database.post("/tracking_check/{user_id}/{channel_id}")
-async def tracking_check(user_id: int, channel_id: str, request: UpdateCheckTracking):
-    conn = sqlite3.connect("messages.db")
-    conn.row_factory = sqlite3.Row
+@db_read
+def tracking_check(user_id: int, channel_id: str, request: UpdateCheckTracking):
+    conn = get_connection()
     c = conn.cursor()
+    c.row_factory = sqlite3.Row
 
     c.execute("""
-        SELECT * FROM message_links
+        SELECT target_channel_id, target_message_id FROM message_links
         WHERE user_id = ? AND channel_id = ? AND message_id = ?
     """, (user_id, channel_id, request.message_id))
     row = c.fetchone()
-    conn.close()
+    c.close()
 
     if row:
         return {
@@ -324,6 +677,6 @@ async def tracking_check(user_id: int, channel_id: str, request: UpdateCheckTrac
         }
 
 @tg_database.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
@@ -0,0 +1,130 @@
+# Sentinel_scheduler.py
+import asyncio
+import time
+
+
+class PipelineStage:
+    """
+    One stage of the pipeline: a bounded asyncio.Queue drained by a fixed number of workers.
+
+    put() waits while the queue is full, so a slow stage pushes back on the stage feeding it
+    instead of letting work pile up in memory.
+    """
+
+    def __init__(self, name, handler, concurrency=1, max_queue=0):
+        self.name = name
+        self.handler = handler              # async callable taking one queued item
+        self.concurrency = max(1, int(concurrency))
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.workers = []
+
+        # Counters for stats()
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_wait = 0.0               # time items spent in the queue
+        self.total_latency = 0.0            # time spent inside handler
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+    async def put(self, item):
+        await self.queue.put((time.perf_counter(), item))
+
+    def offer(self, item):
+        """Enqueue without waiting, returns False when the queue is full."""
+        try:
+            self.queue.put_nowait((time.perf_counter(), item))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def start(self):
+        for i in range(self.concurrency):
+            self.workers.append(asyncio.create_task(self._worker(), name=f"{self.name}-{i}"))
+
+    async def _worker(self):
+        while True:
+            queued_at, item = await self.queue.get()
+            started = time.perf_counter()
+            self.total_wait += started - queued_at
+            self.busy += 1
+            try:
+                await self.handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error in {self.name} stage:", e)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.total_latency += elapsed
+                self.last_latency = elapsed
+                self.max_latency = max(self.max_latency, elapsed)
+                self.busy -= 1
+                self.queue.task_done()
+
+    def stats(self):
+        done = self.processed + self.failed
+        return {
+            "stage": self.name,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "busy": self.busy,
+            "concurrency": self.concurrency,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_wait": self.total_wait / done if done else 0.0,
+            "avg_latency": self.total_latency / done if done else 0.0,
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency,
+        }
+
+
+class PipelineScheduler:
+    """
+    Holds the pipeline stages in order and reports their stats.
+    Other components (caches etc.) can add their counters to the report with add_stats_source().
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.stats_sources = {}             # name -> callable returning a dict
+
+    def add_stage(self, name, handler, concurrency=1, max_queue=0):
+        stage = PipelineStage(name, handler, concurrency=concurrency, max_queue=max_queue)
+        self.stages[name] = stage
+        return stage
+
+    def add_stats_source(self, name, source):
+        self.stats_sources[name] = source
+
+    def start(self):
+        for stage in self.stages.values():
+            stage.start()
+
+    def stats(self):
+        return [stage.stats() for stage in self.stages.values()]
+
+    def format_stats(self):
+        lines = []
+        for s in self.stats():
+            lines.append(
+                f"[{s['stage']}] queue {s['queue_depth']}/{s['queue_size'] or '∞'}, "
+                f"busy {s['busy']}/{s['concurrency']}, done {s['processed']}, failed {s['failed']}, "
+                f"wait avg {s['avg_wait']:.2f}s, "
+                f"latency avg {s['avg_latency']:.2f}s last {s['last_latency']:.2f}s max {s['max_latency']:.2f}s"
+            )
+        for name, source in self.stats_sources.items():
+            try:
+                values = source()
+            except Exception as e:
+                values = {"error": e}
+            if values:
+                lines.append(f"[{name}] " + ", ".join(
+                    f"{k} {v:.2f}" if isinstance(v, float) else f"{k} {v}" for k, v in values.items()
+                ))
+        return "\n".join(lines)
+
+    async def report_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print(self.format_stats())
@@ -3,86 +3,124 @@ import asyncio
 import uvicorn
 import threading
 import httpx
-from Telegram_taking_messages import edits_taker, new_message_taker
-from Telegram_AI_processor import main_once
-from LLM_Suitcase_server import app as llm_app
+from Telegram_taking_messages import sweep_edits, sweep_new_messages, register_update_handlers, find_unjoined_channels
+from Telegram_AI_processor import claim_messages, renew_messages, release_messages, score_messages, publish_message, get_verdict_cache, get_prefilter, get_media_cache, forward_batcher
+from Sentinel_scheduler import PipelineScheduler
+from Telegram_limiter import limiter
+from Telegram_session import SharedTelegramClient
 from SQLite_database import tg_database as db_app
 
-OCCUPIED = False  # Flag to prevent overlap
+telegram = None  # SharedTelegramClient, created inside the running event loop
+scheduler = PipelineScheduler()
+scoring_pending = set()  # Channels already waiting in the scoring queue
+scoring_active = set()   # Channels being scored right now
+
+
+# Ingestion stage: one sweep fetching new messages or scouting edits concurrently,
+# of all channels ("new"/"edits") or of some of them (("new"/"edits", channels))
+async def ingest_handler(item):
+    kind, channels = item if isinstance(item, tuple) else (item, config.TRACKED_CHANNELS)
+    app = await telegram.get()
+    if kind == "new":
+        found = await sweep_new_messages(app, channels)
+    else:
+        found = await sweep_edits(app, channels)
+    for channel, count in found.items():
+        if count:
+            schedule_scoring(channel)
+
+
+# Scoring stage: score pending messages of one channel and hand them to publishing
+async def scoring_handler(channel):
+    scoring_pending.discard(channel)
+    if channel in scoring_active:
+        return  # The active worker reschedules the channel once it is done
+    scoring_active.add(channel)
+    scored = 0
+    try:
+        # Leased messages are not claimed again until they are published (acked) or released
+        claimed = await asyncio.to_thread(claim_messages, config.user_id, channel, config.SCORING_BATCH_SIZE)
+        messages = (claimed or {}).get("messages", [])
+        try:
+            scores = await asyncio.to_thread(score_messages, messages)
+        except Exception:
+            await asyncio.to_thread(release_messages, config.user_id, channel,
+                                    [msg["message_id"] for msg in messages])
+            raise
+        if messages:
+            # Scoring may have taken most of the lease, renew it so it lasts while the messages
+            # wait in the publishing queue or the forward batcher
+            await asyncio.to_thread(renew_messages, config.user_id, channel,
+                                    [msg["message_id"] for msg in messages])
+        for msg, score in zip(messages, scores):
+            await scheduler.stages["publishing"].put((channel, msg, score))  # Waits while publishing is full
+            scored += 1
+    finally:
+        scoring_active.discard(channel)
+    if scored:
+        schedule_scoring(channel)  # Keep draining while the channel has work
+
+
+# Publishing stage: forward/reload/edit/filter one scored message
+async def publishing_handler(item):
+    channel, msg, score = item
+    try:
+        app = await telegram.get()
+        await publish_message(app, msg, score, channel)
+    except Exception:
+        await asyncio.to_thread(release_messages, config.user_id, channel, [msg["message_id"]])
+        raise
+    schedule_scoring(channel)
+
 
+# Never waits: a channel that does not fit into a full scoring queue is picked up by the poll loop
+def schedule_scoring(channel):
+    if channel in scoring_pending:
+        return
+    if scheduler.stages["scoring"].offer(channel):
+        scoring_pending.add(channel)
 
-# Function to run the async main loop for taking messages
-async def run_take_messages_loop():
-    global OCCUPIED
+
+# Function to feed the ingestion stage with new-message fetches
+async def run_take_messages_loop(channels=None):
     while True:
-        try:
-            while OCCUPIED:
-                await asyncio.sleep(2.01)  # Sleep while OCCUPIED is True
-            if not OCCUPIED:
-                print("Lunching taking messages iteration")
-                OCCUPIED = True
-                await new_message_taker()  # Run the async loop for new_message_taker
-                #print("FINISHED taking messages iteration")
-                OCCUPIED = False
-            await asyncio.sleep(config.INTERVAL_TO_GATHER)  # Wait before trying again
-        except Exception as e:
-            print("Error in message taking loop:", e)
+        print("Lunching taking messages iteration")
+        await scheduler.stages["ingest"].put(("new", tuple(channels)) if channels else "new")
+        await asyncio.sleep(config.INTERVAL_TO_GATHER)  # Wait before trying again
 
-# Function to run the async main loop for taking edits
-async def run_take_edits_loop():
-    global OCCUPIED
+# Function to feed the ingestion stage with edit scouting
+async def run_take_edits_loop(channels=None):
     await asyncio.sleep(1.1)
     while True:
-        try:
-            while OCCUPIED:
-                await asyncio.sleep(2.1)  # Sleep while OCCUPIED is True
-            if not OCCUPIED:
-                print("Lunching editing iteration")
-                OCCUPIED = True
-                await edits_taker()  # Run the async loop for edits_taker
-                #print("FINISHED editing iteration")
-                OCCUPIED = False
-            await asyncio.sleep(config.INTERVAL_FOR_SCOUT)  # Wait before trying again
-        except Exception as e:
-            print("Error in message taking loop:", e)
+        print("Lunching editing iteration")
+        await scheduler.stages["ingest"].put(("edits", tuple(channels)) if channels else "edits")
+        await asyncio.sleep(config.INTERVAL_FOR_SCOUT)  # Wait before trying again
 
+# Function to queue a catch-up poll of every channel, used in PUSH mode to fill gaps
+def schedule_catch_up():
+    scheduler.stages["ingest"].offer("new")
+    scheduler.stages["ingest"].offer("edits")
 
-# Function to run the AI processing loop for main_once
-async def run_main_once():
-    global OCCUPIED
-    i = 0
+async def run_catch_up_loop():
     while True:
-        try:
-            if not OCCUPIED:
-                OCCUPIED = True
-                # Run the synchronous main_once() in a separate thread with an event loop
-                #print("Started posting iteration")
-                await asyncio.to_thread(run_main_once_in_thread)
-                print(f"Loop count: {i}")
-                i += 1
-                OCCUPIED = False
-            await asyncio.sleep(5)  # Sleep before checking again
-        except Exception as e:
-            print("Error in AI processing loop:", e)
-
+        await asyncio.sleep(config.INTERVAL_TO_CATCH_UP)
+        print("Lunching catch-up iteration")
+        schedule_catch_up()
 
-# This is the helper function that runs main_once in the background thread
-def run_main_once_in_thread():
-    # Create a new event loop for this thread
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-
-    # Run the main_once function in the new event loop
-    try:
-        # Try to run the main_once function inside the new event loop
-        loop.run_until_complete(main_once())  # Run the synchronous function inside the new event loop
-    except TypeError as e:
-        # If a TypeError occurs (due to asyncio.Future or coroutine issue), print the error and continue
-        # print(f"Error running main_once: {e}. Continuing with next iteration.")
-        pass  # Continue without crashing
+# Function to pick up messages left in "new"/"edited" status (e.g. after restart)
+async def run_scoring_poll_loop():
+    while True:
+        for channel in config.TRACKED_CHANNELS:
+            schedule_scoring(channel)
+        await asyncio.sleep(config.PIPELINE_POLL_INTERVAL)
 
 
 def run_llm_server():
+    if config.LLM_WORKERS > 1:
+        from LLM_dispatcher import run_dispatcher
+        run_dispatcher()  # Worker processes behind a load-balancing dispatcher on llm_port
+        return
+    from LLM_Suitcase_server import app as llm_app
     uvicorn.run(
         llm_app,
         host=config.llm_ipaddress,
@@ -112,7 +150,7 @@ async def wait_for_server(url, interval=2):
             print(f"Waiting for {url}... ({e})")
         await asyncio.sleep(interval)
 
-# Main async loop to run both tasks concurrently
+# Main async loop wiring the pipeline: ingest -> scoring -> publishing
 async def main_loop():
     threading.Thread(target=run_db_server, daemon=False).start()
     threading.Thread(target=run_llm_server, daemon=False).start()
@@ -120,12 +158,56 @@ async def main_loop():
     await wait_for_server(f"http://{config.llm_ipaddress}:{config.llm_port}/")
     await wait_for_server(f"http://{config.database_ipaddress}:{config.database_port}/health")
 
-    task1 = asyncio.create_task(run_take_messages_loop())  # Async task for message-taking
-    task2 = asyncio.create_task(run_take_edits_loop())  # Async task for edits-taking
-    task3 = asyncio.create_task(run_main_once())  # Async task for AI processing
-
-    # Wait for both tasks to finish (they run indefinitely, so the program keeps running)
-    await asyncio.gather(task1, task2, task3)
+    global telegram
+    telegram = SharedTelegramClient()
+    if config.INGEST_MODE == "PUSH":
+        register_update_handlers(telegram, on_ingested=schedule_scoring)
+        telegram.on_connect(schedule_catch_up)  # Also runs on the first connect
+
+    scheduler.add_stage("ingest", ingest_handler,
+                        concurrency=config.INGEST_CONCURRENCY)
+    scheduler.add_stage("scoring", scoring_handler,
+                        concurrency=config.SCORING_CONCURRENCY,
+                        max_queue=config.SCORING_QUEUE_SIZE)
+    scheduler.add_stage("publishing", publishing_handler,
+                        concurrency=config.PUBLISHING_CONCURRENCY,
+                        max_queue=config.PUBLISHING_QUEUE_SIZE)
+    classifier = get_prefilter()
+    if classifier:
+        scheduler.add_stats_source("prefilter", classifier.stats)
+    cache = get_verdict_cache()
+    if cache:
+        scheduler.add_stats_source("verdict_cache", cache.stats)
+    media_cache = get_media_cache()
+    if media_cache:
+        scheduler.add_stats_source("media_cache", media_cache.stats)
+    scheduler.add_stats_source("telegram", limiter.stats)
+    if config.FORWARD_BATCH_WINDOW > 0:
+        scheduler.add_stats_source("forwarding", forward_batcher.stats)
+    scheduler.start()
+    await telegram.start()
+
+    tasks = [
+        asyncio.create_task(run_scoring_poll_loop()),   # Feeds scoring with leftover backlog
+        asyncio.create_task(telegram.watchdog()),       # Restarts the Telegram client if it drops
+    ]
+    if config.INGEST_MODE == "PUSH":
+        if config.INTERVAL_TO_CATCH_UP:
+            tasks.append(asyncio.create_task(run_catch_up_loop()))
+        # No updates are pushed for channels the account has not joined, keep polling those
+        unjoined = await find_unjoined_channels(await telegram.get())
+        if unjoined:
+            print(f"Not a member of {unjoined}, polling them every {config.INTERVAL_TO_GATHER}s")
+            tasks.append(asyncio.create_task(run_take_messages_loop(unjoined)))
+            tasks.append(asyncio.create_task(run_take_edits_loop(unjoined)))
+    else:
+        tasks.append(asyncio.create_task(run_take_messages_loop()))  # Feeds ingestion with new-message fetches
+        tasks.append(asyncio.create_task(run_take_edits_loop()))     # Feeds ingestion with edit scouting
+    if config.PIPELINE_STATS_INTERVAL:
+        tasks.append(asyncio.create_task(scheduler.report_loop(config.PIPELINE_STATS_INTERVAL)))
+
+    # The loops run indefinitely, so the program keeps running
+    await asyncio.gather(*tasks)
 
 
 if __name__ == "__main__":
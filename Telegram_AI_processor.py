@@ -1,6 +1,9 @@
 # Telegram_AI_processor.py
 import os
 import time
+import socket
+from datetime import datetime
+import asyncio
 import requests
 import ast
 import bisect
@@ -8,10 +11,15 @@ import re
 from pyrogram import Client
 from pyrogram.types import InputMediaDocument, InputMediaPhoto, InputMediaVideo, MessageEntity, User
 from pyrogram.enums import MessageEntityType
-from pyrogram.errors import MediaCaptionTooLong
+from pyrogram.errors import MediaCaptionTooLong, BadRequest
 from pyrogram.errors.exceptions.bad_request_400 import MessageNotModified
 import json
+import threading
 import config
+from Verdict_cache import VerdictCache
+from Media_cache import MediaCache
+from Prefilter import create_prefilter, ASK, OUTCOME_SCORES
+from Telegram_limiter import limiter, PRIORITY_PUBLISH
 
 
 # Telegram API session
@@ -29,6 +37,13 @@ llm_ipaddress = config.llm_ipaddress
 llm_port = config.llm_port
 LLM_API = f"http://{llm_ipaddress}:{llm_port}"             # your LLM suitcase server
 
+# Forwarding
+FORWARD_BATCH_WINDOW = config.FORWARD_BATCH_WINDOW
+
+# Media reloading
+MEDIA_DOWNLOAD_CONCURRENCY = config.MEDIA_DOWNLOAD_CONCURRENCY
+MEDIA_IN_MEMORY_MAX_SIZE = config.MEDIA_IN_MEMORY_MAX_SIZE
+
 # Channels and users
 TRACKED_CHANNELS = config.TRACKED_CHANNELS
 TARGET_CHANNEL = config.TARGET_CHANNEL
@@ -37,6 +52,9 @@ user_id = config.user_id
 # Scoring parameters
 Scoring_parameter = config.Scoring_parameter
 Scoring_messaging_gap = config.Scoring_messaging_gap
+LLM_SCORE_GRAMMAR = config.LLM_SCORE_GRAMMAR
+SCORING_BATCH_SIZE = config.SCORING_BATCH_SIZE
+VERDICT_CACHE = config.VERDICT_CACHE
 
 # Transfer method
 REMOVE_CUSTOM_EMOJI = config.REMOVE_CUSTOM_EMOJI
@@ -169,56 +187,73 @@ def _parse_entities(entities_raw):
             print("WARN: couldn't parse messages_entities (truncated):", s[:200])
             return []
 
-def _build_utf16_prefix(text: str):
-    """
-    Build prefix array where prefix[i] = number of UTF-16 code units in text[:i].
-    This allows mapping Telegram offsets (UTF-16 code units) to Python indices.
-    """
-    prefix = [0]
-    for ch in text:
-        # number of UTF-16 code units for this character
-        units = len(ch.encode('utf-16-le')) // 2
-        prefix.append(prefix[-1] + units)
-    return prefix
-
-def _utf16_index_to_py(prefix, utf16_index):
+# Characters outside the BMP, the only ones taking two UTF-16 code units
+_astral = re.compile("[\U00010000-\U0010FFFF]")
+
+def _utf16_to_py_mapper(text: str):
     """
-    Convert a utf16_index (Telegram-style) to a python string index using prefix array.
-    We use bisect_left so exact boundaries map correctly.
+    Return a function mapping Telegram offsets (UTF-16 code units) to Python indices of text.
+    Only the positions of astral characters are needed, found in one regex pass; an offset
+    inside a surrogate pair maps to the index after that character.
     """
-    if utf16_index <= 0:
-        return 0
-    if utf16_index >= prefix[-1]:
-        return len(prefix) - 1  # python index = number of chars
-    return bisect.bisect_left(prefix, utf16_index)
+    # UTF-16 offset of every astral character: its Python index plus the astral characters before it
+    astral_offsets = [m.start() + k for k, m in enumerate(_astral.finditer(text))]
+    total = len(text) + len(astral_offsets)
+
+    def to_py(utf16_index):
+        if utf16_index <= 0:
+            return 0
+        if utf16_index >= total:
+            return len(text)
+        return utf16_index - bisect.bisect_left(astral_offsets, utf16_index - 1)
+
+    return to_py
+
+_ENTITY_MARKERS = {
+    "BOLD": ("**", "**"),
+    "STRIKETHROUGH": ("~~", "~~"),
+    "ITALIC": ("__", "__"),
+    "CODE": ("`", "`"),
+    "PRE": ("```", "```"),
+}
+_LINK_TYPES = ("TEXT_LINK", "URL", "TEXTURL")
+
+def _escape_for_markdown(s):
+    # minimal escaping for bracket/paren characters inside link text
+    return s.replace("]", "\\]").replace("(", "\\(").replace(")", "\\)")
 
 def apply_entities_to_text(text: str, entities_raw) -> str:
     """
     Apply message entities to text producing Markdown-like formatting:
       - BOLD -> **text**
-      - ITALIC -> *text*
+      - ITALIC -> __text__
+      - STRIKETHROUGH -> ~~text~~
       - TEXT_LINK -> [text](url)
       - CODE -> `text`
       - PRE -> ```text```
     Accepts entities as JSON string or list.
+
+    Built in one pass over the entity boundaries. Nested entities nest in the output; an entity
+    crossing the end of another is closed there and reopened after, so markers always pair up.
     """
     entities = _parse_entities(entities_raw)
     if not entities:
         return text
 
-    # build utf-16 prefix map once
-    prefix = _build_utf16_prefix(text)
+    to_py = _utf16_to_py_mapper(text)
 
-    normalized = []
-    for e in entities:
+    spans = []  # (start, end, order, opening, closing, is_link)
+    for order, e in enumerate(entities):
         try:
             offset = int(e.get("offset", 0))
             length = int(e.get("length", 0))
         except Exception:
             continue
 
-        start = _utf16_index_to_py(prefix, offset)
-        end = _utf16_index_to_py(prefix, offset + length)
+        start = to_py(offset)
+        end = to_py(offset + length)
+        if end <= start:
+            continue
 
         type_raw = e.get("type", "")
         # normalize e.g. "MessageEntityType.BOLD" -> "BOLD"
@@ -227,69 +262,83 @@ def apply_entities_to_text(text: str, entities_raw) -> str:
         else:
             type_clean = str(type_raw).upper()
 
-        normalized.append({
-            "start": start,
-            "end": end,
-            "type": type_clean,
-            "url": e.get("url")
-        })
-
-    # apply from back to front so indexes don't shift
-    normalized.sort(key=lambda x: x["start"], reverse=True)
-
-    def _escape_for_markdown(s):
-        # minimal escaping for bracket/paren characters inside link text
-        return s.replace("]", "\\]").replace("(", "\\(").replace(")", "\\)")
-
-    for ent in normalized:
-        s, e = ent["start"], ent["end"]
-        if s < 0: s = 0
-        if e < s: e = s
-        if s >= len(text):
-            continue
-        if e > len(text):
-            e = len(text)
-        substring = text[s:e]
-
-        t = ent["type"]
-        if t == "BOLD":
-            repl = f"**{substring}**"
-        elif t == "STRIKETHROUGH":
-            repl = f"~~{substring}~~"
-        elif t == "ITALIC":
-            repl = f"__{substring}__"
-        elif t in ("TEXT_LINK", "URL", "TEXTURL"):
-            url = ent.get("url")
-            if url:
-                repl = f"[{_escape_for_markdown(substring)}]({url})"
-            else:
-                repl = substring
-        elif t == "CODE":
-            repl = f"`{substring}`"
-        elif t == "PRE":
-            repl = f"```{substring}```"
-        else:
-            # unknown entity type — leave as-is (could add more types later)
-            repl = substring
-
-        text = text[:s] + repl + text[e:]
+        if type_clean in _ENTITY_MARKERS:
+            opening, closing = _ENTITY_MARKERS[type_clean]
+            spans.append((start, end, order, opening, closing, False))
+        elif type_clean in _LINK_TYPES and e.get("url"):
+            spans.append((start, end, order, "[", f"]({e.get('url')})", True))
+        # unknown entity types and links without url leave the text as-is
 
-    return text
+    if not spans:
+        return text
 
-def fetch_one_message(user_id, channel_id):
-    url = f"{DB_API}/processing/{user_id}/{channel_id}?limit=1"
+    # Outer entities first: earlier start, then later end, then message order
+    spans.sort(key=lambda x: (x[0], -x[1], x[2]))
+    boundaries = sorted({x[0] for x in spans} | {x[1] for x in spans})
+    ends = {}           # number of spans ending at each boundary
+    for x in spans:
+        ends[x[1]] = ends.get(x[1], 0) + 1
+    span_count = len(spans)
+
+    out = []
+    stack = []          # open spans, innermost last
+    links_open = 0
+    pos = 0
+    next_span = 0
+    for boundary in boundaries:
+        segment = text[pos:boundary]
+        out.append(_escape_for_markdown(segment) if links_open else segment)
+        pos = boundary
+
+        # Close what ends here, together with everything opened inside it
+        reopen = []
+        closing = ends.get(boundary, 0)
+        while closing and stack[-1][1] == boundary:
+            span = stack.pop()
+            out.append(span[4])
+            links_open -= span[5]
+            closing -= 1
+        if closing:
+            # A span ending here is still open below others that cross it
+            first = next(i for i, x in enumerate(stack) if x[1] == boundary)
+            while len(stack) > first:
+                span = stack.pop()
+                out.append(span[4])
+                links_open -= span[5]
+                if span[1] != boundary:
+                    reopen.append(span)
+            reopen.reverse()
+
+        # Reopen the crossed spans and open the new ones, the longest outermost
+        while next_span < span_count and spans[next_span][0] == boundary:
+            reopen.append(spans[next_span])
+            next_span += 1
+        if len(reopen) > 1:
+            reopen.sort(key=lambda x: -x[1])
+        for span in reopen:
+            out.append(span[3])
+            links_open += span[5]
+            stack.append(span)
+
+    out.append(text[pos:])
+    return "".join(out)
+
+def fetch_pending_messages(user_id, channel_id, limit=1):
+    url = f"{DB_API}/processing/{user_id}/{channel_id}?limit={limit}"
     try:
         response = requests.get(url)
         response.raise_for_status()
         data = response.json()
-        return data  # return the first message (dict with message_id, text, status, etc.)
+        return data  # {"messages": [...]} up to limit pending rows (message_id, text, status, etc.), not leased
     except Exception as e:
         print(f"Error fetching message: {e}")
         return None
 
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"  # lease owner of this process
+
 def request_filtering(user_id: int, channel_id: str, message_id: int) -> dict:
     url = f"{DB_API}/filtering/{user_id}/{channel_id}"
-    payload = {"message_id": message_id}
+    payload = {"message_id": message_id, "owner": WORKER_ID}
     try:
         response = requests.post(url, json=payload)
         response.raise_for_status()
@@ -298,6 +347,57 @@ def request_filtering(user_id: int, channel_id: str, message_id: int) -> dict:
         print(f"Error filtering message {message_id}: {e}")
         return {"status": "error", "message_id": message_id}
 
+def claim_messages(user_id, channel_id, limit=1, lease_seconds=config.LEASE_SECONDS):
+    """
+    Lease up to limit pending messages of a channel for this worker. Other workers do not get them
+    until the lease expires or release_messages() is called, /filtering acks them.
+    Renew the lease with renew_messages() once they are scored, so it covers publishing too.
+    """
+    url = f"{DB_API}/claim/{user_id}/{channel_id}"
+    payload = {"owner": WORKER_ID, "limit": limit, "lease_seconds": lease_seconds}
+    try:
+        response = requests.post(url, json=payload)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error claiming messages: {e}")
+        return None
+
+def renew_messages(user_id, channel_id, message_ids, lease_seconds=config.LEASE_SECONDS):
+    """Extend the leases of this worker on message_ids by lease_seconds from now."""
+    url = f"{DB_API}/renew/{user_id}/{channel_id}"
+    payload = {"owner": WORKER_ID, "message_ids": list(message_ids), "lease_seconds": lease_seconds}
+    try:
+        response = requests.post(url, json=payload)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error renewing leases: {e}")
+        return None
+
+def release_messages(user_id, channel_id, message_ids, retry_after=config.LEASE_RETRY_DELAY):
+    """Give leased messages back, they can be claimed again after retry_after seconds."""
+    url = f"{DB_API}/release/{user_id}/{channel_id}"
+    payload = {"owner": WORKER_ID, "message_ids": list(message_ids), "retry_after": retry_after}
+    try:
+        response = requests.post(url, json=payload)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error releasing messages: {e}")
+        return None
+
+def request_scores(user_id: int, channel_id: str, scores: list):
+    """Store LLM verdicts [{"message_id", "score"}] for pre-filter calibration."""
+    url = f"{DB_API}/scores/{user_id}/{channel_id}"
+    try:
+        response = requests.post(url, json=scores)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error recording scores: {e}")
+        return None
+
 def request_tracking(user_id: int, channel_id: str, message_id: str, target_channel_id: str, target_message_id: str):
     url = f"{DB_API}/tracking/{user_id}/{channel_id}"
     payload = {
@@ -313,6 +413,17 @@ def request_tracking(user_id: int, channel_id: str, message_id: str, target_chan
         print(f"Error updating tracking: {e}")
         return None
 
+def request_published(user_id: int, channel_id: str, records: list):
+    """Mark messages filtered and store their tracking [{"message_id", "target_channel_id", "target_message_id"}] at once."""
+    url = f"{DB_API}/published/{user_id}/{channel_id}"
+    try:
+        response = requests.post(url, json={"owner": WORKER_ID, "records": records})
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error recording published messages: {e}")
+        return None
+
 def request_tracking_check(user_id: int, channel_id: str, message_id: str) -> dict:
     url = f"{DB_API}/tracking_check/{user_id}/{channel_id}"
     payload = {"message_id": message_id}
@@ -331,29 +442,94 @@ def update_message_status(msg_id, status, new_text=None):
     resp = requests.post(f"{DB_API}/messages/{msg_id}/update", json=payload)
     return resp.json()
 
-def analyze_message_with_llm(message: dict, max_tokens: int = 256) -> str:
+def format_message_text(message: dict) -> str:
     """
-    Builds prompt from message, applying message entities (links, bold, etc.)
-    so the LLM sees Markdown-style formatting.
+    Message text with its entities (links, bold, etc.) applied as Markdown-style formatting.
     """
     raw_text = message.get("text", "") or ""
     entities_raw = message.get("messages_entities")
+    return apply_entities_to_text(raw_text, entities_raw)
 
-    formatted_text = apply_entities_to_text(raw_text, entities_raw)
+TEXT_PLACEHOLDER = "{text}"  # Filled in by the LLM server, which truncates the text to its context budget
+
+def build_prompt(message: dict, formatted_text: str = None) -> str:
+    """
+    Builds prompt from message, applying message entities (links, bold, etc.)
+    so the LLM sees Markdown-style formatting.
+    """
+    if formatted_text is None:
+        formatted_text = format_message_text(message)
 
     # debug: what we actually send to the LLM
     #print("Formatted text sent to LLM:")
     #print(formatted_text)
 
-    prompt = prompt_template.format(
+    return prompt_template.format(
         channel_id=message.get("channel_id", "unknown"),
         text=formatted_text,
         Scoring_parameter=Scoring_parameter,
     )
-    # Call the LLM API
+
+verdict_cache = None
+shared_instances_lock = threading.Lock()  # Guards the lazily created shared instances below
+prefilter = None
+media_cache = None
+
+def get_verdict_cache():
+    """Shared VerdictCache, opened on first use. None when VERDICT_CACHE is off."""
+    global verdict_cache
+    if not VERDICT_CACHE:
+        return None
+    with shared_instances_lock:
+        if verdict_cache is None:
+            verdict_cache = VerdictCache()
+        return verdict_cache
+
+def get_media_cache():
+    """Shared MediaCache, opened on first use. None when MEDIA_CACHE is off."""
+    global media_cache
+    if not config.MEDIA_CACHE:
+        return None
+    with shared_instances_lock:
+        if media_cache is None:
+            media_cache = MediaCache()
+        return media_cache
+
+def get_prefilter():
+    """Shared pre-filter stage, created on first use. None when PREFILTER is off."""
+    global prefilter
+    if not config.PREFILTER:
+        return None
+    with shared_instances_lock:
+        if prefilter is None:
+            prefilter = create_prefilter()
+        return prefilter
+
+def message_priority(message: dict) -> int:
+    """
+    LLM queue priority of a message: fresh posts and edits ahead of older backlog.
+    Dates are stored as str(pyrogram date), naive local time.
+    """
+    latest = None
+    for field in ("message_edit_date", "message_date"):
+        try:
+            date = datetime.fromisoformat(message.get(field) or "")
+        except ValueError:
+            continue
+        if latest is None or date > latest:
+            latest = date
+    if latest is not None and (datetime.now() - latest).total_seconds() < config.LLM_FRESH_AGE:
+        return config.LLM_PRIORITY_FRESH
+    return config.LLM_PRIORITY_BACKFILL
+
+def analyze_message_with_llm(message: dict, max_tokens: int = 256) -> str:
+    prompt = build_prompt(message, TEXT_PLACEHOLDER)
+    # Call the LLM API, the server inserts the text and cuts it down if the prompt would not fit its context
     response = requests.post(
         f"{LLM_API}/generate",
-        json={"prompt": prompt, "max_tokens": max_tokens}
+        json={"prompt": prompt, "text": format_message_text(message), "max_tokens": max_tokens,
+              "score_parameter": Scoring_parameter, "use_grammar": LLM_SCORE_GRAMMAR,
+              "priority": message_priority(message)}
     )
 
     if response.status_code == 200:
@@ -361,126 +537,350 @@ def analyze_message_with_llm(message: dict, max_tokens: int = 256) -> str:
     else:
         raise RuntimeError(f"LLM API error {response.status_code}: {response.text}")
 
-def process_forwarding(msg, message_ids, CHANNEL_USERNAME):
-    with Client(SESSION_NAME, api_id=API_ID, api_hash=API_HASH) as app:
+def analyze_messages_with_llm(messages: list, max_tokens: int = 256) -> list:
+    """
+    Same as analyze_message_with_llm, but for many messages in one /generate_batch round trip.
+    Responses are returned in the order of messages.
+    """
+    prompts = [build_prompt(message, TEXT_PLACEHOLDER) for message in messages]
+    texts = [format_message_text(message) for message in messages]
+    response = requests.post(
+        f"{LLM_API}/generate_batch",
+        json={"prompts": prompts, "texts": texts, "max_tokens": max_tokens,
+              "score_parameter": Scoring_parameter, "use_grammar": LLM_SCORE_GRAMMAR,
+              "priority": min(message_priority(message) for message in messages)}
+    )
+
+    if response.status_code == 200:
+        return [r.strip() for r in response.json().get("responses", [])]
+    else:
+        raise RuntimeError(f"LLM API error {response.status_code}: {response.text}")
+
+def track_published(msg, channel_id, published):
+    """
+    Record which TARGET_CHANNEL messages a publish created, taken from the Messages Telegram returned
+    for it, so concurrent posts to the target channel cannot be mistaken for ours.
+    """
+    target_message = ",".join(str(m.id) for m in published if m)
+    if not target_message:
+        print(f"Nothing was published for message {msg['message_id']}, not tracked")
+        return None
+    return request_tracking(
+        msg['user_id'],
+        channel_id,
+        msg['message_id'],
+        str(TARGET_CHANNEL),
+        target_message
+    )
+
+async def process_forwarding(app, msg, message_ids, CHANNEL_USERNAME):
+    published = []
+    try:
+        published = await limiter.call(PRIORITY_PUBLISH, app.forward_messages,
+            chat_id=TARGET_CHANNEL,
+            from_chat_id=CHANNEL_USERNAME,
+            message_ids=message_ids
+        )
+    except Exception as e:
+        print(f"Error from telegram API or Pyrogram while forwarding messages: {e}")
+
+    # Call filter endpoint
+    filter_result = await asyncio.to_thread(request_filtering,
+        msg['user_id'],
+        msg['channel_id'],
+        msg['message_id']
+    )
+    #print(filter_result)
+
+    # Track the mapping
+    tracking_result = await asyncio.to_thread(track_published, msg, msg['channel_id'], published)
+    #print(tracking_result)
+
+class ForwardBatcher:
+    """
+    Forwards approved, unprotected messages of a source channel together.
+
+    Messages added within FORWARD_BATCH_WINDOW seconds are forwarded with one ordered forward_messages call
+    (at most FORWARD_BATCH_MAX_IDS ids), the forwarded copies are split back per source message by their
+    forward origin, and filtering plus tracking of the whole batch is stored in one DB transaction.
+    add() returns right away; when the forward fails the leases of the batch are released for a retry.
+    Once the forward went through the batch is never released: its ack is retried, see _ack().
+    """
+
+    def __init__(self, window=config.FORWARD_BATCH_WINDOW, max_ids=config.FORWARD_BATCH_MAX_IDS,
+                 ack_retries=config.FORWARD_ACK_RETRIES):
+        self.window = window
+        self.max_ids = max_ids
+        self.ack_retries = ack_retries
+        self.pending = {}       # (user_id, channel_id, from_chat_id) -> [(msg, message_ids)]
+        self.unacked = {}       # (user_id, channel_id) -> records of forwarded messages the DB has not acked yet
+        self.timers = {}
+        self.tasks = set()      # running flushes
+        self.forwards = 0
+        self.forwarded = 0
+
+    def add(self, app, msg, message_ids, channel):
+        key = (msg['user_id'], msg['channel_id'], channel)
+        batch = self.pending.setdefault(key, [])
+        if batch and sum(len(ids) for _, ids in batch) + len(message_ids) > self.max_ids:
+            self._start_flush(app, key)
+            batch = self.pending.setdefault(key, [])
+        batch.append((msg, list(message_ids)))
+        if key not in self.timers:
+            self.timers[key] = asyncio.create_task(self._flush_later(app, key))
+
+    async def _flush_later(self, app, key):
+        await asyncio.sleep(self.window)
+        self.timers.pop(key, None)
+        self._start_flush(app, key)
+
+    def _start_flush(self, app, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(key, None)
+        if batch:
+            task = asyncio.create_task(self._flush(app, key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _flush(self, app, key, batch):
+        user_id, channel_id, from_chat_id = key
+        batch.sort(key=lambda entry: min(entry[1]))    # Keep the source order in the target channel
+        ids = [i for _, message_ids in batch for i in message_ids]
         try:
-            app.forward_messages(
+            forwarded = await limiter.call(PRIORITY_PUBLISH, app.forward_messages,
                 chat_id=TARGET_CHANNEL,
-                from_chat_id=CHANNEL_USERNAME,
-                message_ids=message_ids
+                from_chat_id=from_chat_id,
+                message_ids=ids
             )
         except Exception as e:
-            print(f"Error from telegram API or Pyrogram while forwarding messages: {e}")
-
-        # Call filter endpoint
-        filter_result = request_filtering(
-            msg['user_id'],
-            msg['channel_id'],
-            msg['message_id']
-        )
-        #print(filter_result)
+            print(f"Error from telegram API or Pyrogram while forwarding {len(ids)} messages: {e}")
+            await asyncio.to_thread(release_messages, user_id, channel_id, [msg['message_id'] for msg, _ in batch])
+            return
+        self.forwards += 1
+        self.forwarded += len(batch)
+
+        by_source = {getattr(m.forward_origin, "message_id", None): m for m in forwarded if m}
+        if not all(i in by_source for i in ids) and len(forwarded) == len(ids):
+            by_source = dict(zip(ids, forwarded))  # No forward origin to match by, results come in request order
+        records = [{
+            "message_id": msg['message_id'],
+            "target_channel_id": str(TARGET_CHANNEL),
+            "target_message_id": ",".join(str(by_source[i].id) for i in message_ids if i in by_source),
+        } for msg, message_ids in batch]
+        await self._ack(user_id, channel_id, self.unacked.pop((user_id, channel_id), []) + records)
+
+    async def _ack(self, user_id, channel_id, records):
+        """
+        Store filtering and tracking of forwarded messages. A failed ack is retried with a growing delay
+        and the leases are renewed meanwhile, otherwise the messages would be claimed and forwarded again.
+        Records still not acked are kept in unacked and sent along with the next flush of the channel.
+        """
+        message_ids = [r["message_id"] for r in records]
+        delay = 1
+        for attempt in range(self.ack_retries + 1):
+            if await asyncio.to_thread(request_published, user_id, channel_id, records) is not None:
+                return True
+            if attempt < self.ack_retries:
+                await asyncio.to_thread(renew_messages, user_id, channel_id, message_ids)
+                await asyncio.sleep(delay)
+                delay *= 2
+        print(f"Could not ack {len(records)} forwarded messages of {channel_id}, kept for the next flush")
+        self.unacked.setdefault((user_id, channel_id), []).extend(records)
+        return False
+
+    async def flush_all(self, app):
+        """Forward everything pending now and wait for it, e.g. before the client is closed."""
+        for key in list(self.pending):
+            self._start_flush(app, key)
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        for (user_id, channel_id), records in list(self.unacked.items()):
+            del self.unacked[(user_id, channel_id)]
+            await self._ack(user_id, channel_id, records)
+
+    def stats(self):
+        return {
+            "pending": sum(len(batch) for batch in self.pending.values()),
+            "unacked": sum(len(records) for records in self.unacked.values()),
+            "forwards": self.forwards,
+            "forwarded": self.forwarded,
+            "per_forward": self.forwarded / self.forwards if self.forwards else 0.0,
+        }
+
+
+forward_batcher = ForwardBatcher()
+
+async def forward_message(app, msg, message_ids, channel):
+    """Forward through the batcher when FORWARD_BATCH_WINDOW is set, otherwise right away."""
+    if FORWARD_BATCH_WINDOW > 0:
+        forward_batcher.add(app, msg, message_ids, channel)
+    else:
+        await process_forwarding(app, msg, message_ids, channel)
+
+def media_file_name(msg_obj):
+    """Original file name of the media if available, otherwise <message_id>.<extension of the media type>."""
+    message_id = msg_obj.id
+    # Preserve original file name if available
+    if hasattr(msg_obj, "animation") and msg_obj.animation:
+        return msg_obj.animation.file_name if msg_obj.animation.file_name else f"{message_id}.gif"
+    # Check if it's a sticker
+    if hasattr(msg_obj, "sticker") and msg_obj.sticker:
+        return msg_obj.sticker.file_name if msg_obj.sticker.file_name else f"{message_id}.webp"
+    # Check if it's a document (general file)
+    if hasattr(msg_obj, "document") and msg_obj.document:
+        return msg_obj.document.file_name if msg_obj.document.file_name else f"{message_id}.file"
+    # Check if it's a video
+    if hasattr(msg_obj, "video") and msg_obj.video:
+        return msg_obj.video.file_name if msg_obj.video.file_name else f"{message_id}.mp4"
+    # Check if it's a photo
+    if hasattr(msg_obj, "photo") and msg_obj.photo:
+        return getattr(msg_obj.photo, "file_name", f"{message_id}.jpg")
+    # Default case if none of the above
+    return f"{message_id}.unknown"
+
+
+def media_kind(msg_obj):
+    if msg_obj.photo:
+        return "PHOTO"
+    if msg_obj.video:
+        return "VIDEO"
+    if msg_obj.document:
+        return "DOCUMENT"
+    return "OTHER"
+
+
+def media_object(msg_obj):
+    """The Photo/Video/Document/... of a message, None without media."""
+    return getattr(msg_obj, msg_obj.media.value, None) if msg_obj.media else None
+
+
+def media_file_size(msg_obj):
+    return getattr(media_object(msg_obj), "file_size", None) or 0
+
+
+def media_unique_id(msg_obj):
+    return getattr(media_object(msg_obj), "file_unique_id", None)
+
+
+def record_uploads(sent_messages, unique_ids):
+    """Remember the file_ids of our uploads in TARGET_CHANNEL, so re-sends of the same files skip the upload."""
+    cache = get_media_cache()
+    if cache is None:
+        return
+    for sent, unique_id in zip(sent_messages, unique_ids):
+        file_id = getattr(media_object(sent), "file_id", None)
+        if unique_id and file_id:
+            cache.remember_upload(unique_id, file_id)
+
+
+async def download_media(msg_obj, media_path, semaphore, pinned):
+    """
+    Download one album part, into memory when it is at most MEDIA_IN_MEMORY_MAX_SIZE, otherwise under media_path.
+    Returns the file path or the in-memory file (its .name is set), both can be passed to InputMedia*/send_document.
 
-        # Fetch latest messages from target channel
-        latest_messages = list(app.get_chat_history(
-            chat_id=TARGET_CHANNEL,
-            limit=len(message_ids)
-        ))
+    With the media cache on, a file uploaded before comes back as the file_id of that upload and a file
+    downloaded before as its path in the store; new downloads are added to the store.
+    Store files returned as paths are pinned against eviction, their ids are appended to pinned.
+    """
+    file_name = media_file_name(msg_obj)
+    cache = get_media_cache()
+    unique_id = media_unique_id(msg_obj)
+    cached = cache is not None and unique_id is not None
+    if cached:
+        path, file_id = await asyncio.to_thread(cache.lookup, unique_id)
+        if file_id:
+            return file_id
+        if path:
+            pinned.append(unique_id)
+            return path
+
+    async with semaphore:
+        in_memory = media_file_size(msg_obj) <= MEDIA_IN_MEMORY_MAX_SIZE
+        if in_memory:
+            file = await limiter.call(PRIORITY_PUBLISH, msg_obj.download, file_name, in_memory=True)
+        elif cached:
+            file = await limiter.call(PRIORITY_PUBLISH, msg_obj.download, cache.path_for(unique_id, file_name))
+        else:
+            file = await limiter.call(PRIORITY_PUBLISH, msg_obj.download, os.path.join(media_path, file_name))
+    print(f"Downloaded: {file_name}")
 
-        target_message = ",".join(str(m.id) for m in latest_messages)
-        #print(msg["message_id"])
-        #print(target_message)
+    if cached:
+        if in_memory:
+            await asyncio.to_thread(cache.store, unique_id, file_name, file.getvalue())
+        else:
+            await asyncio.to_thread(cache.add, unique_id, file, True)
+            pinned.append(unique_id)
+    return file
 
-        # Track the mapping
-        tracking_result = request_tracking(
-            msg['user_id'],
-            msg['channel_id'],
-            msg['message_id'],
-            str(TARGET_CHANNEL),
-            target_message
-        )
-        #print(tracking_result)
-
-def process_reloading(msg, message_ids, TRACKED_CHANNEL):
-    with Client(SESSION_NAME, api_id=API_ID, api_hash=API_HASH) as app:
-        channel_username = TRACKED_CHANNEL
-        media_path = os.path.join("media", str(channel_username))
-        os.makedirs(media_path, exist_ok=True)
-
-        saved_files = []
-        media_types = []
-
-        # Download media from messages
-        for message_id in message_ids:
-            msg_obj = app.get_messages(chat_id=channel_username, message_ids=message_id)
-            if msg_obj.media and not msg_obj.web_page:  # skip web_page for downloading
-                # Preserve original file name if available
-                if hasattr(msg_obj, "animation") and msg_obj.animation:
-                    file_name = msg_obj.animation.file_name if msg_obj.animation.file_name else f"{message_id}.gif"
-                    #print("This is an Animation (GIF) file!")
-
-                # Check if it's a sticker
-                elif hasattr(msg_obj, "sticker") and msg_obj.sticker:
-                    file_name = msg_obj.sticker.file_name if msg_obj.sticker.file_name else f"{message_id}.webp"
-                    #print("This is a Sticker file!")
-
-                # Check if it's a document (general file)
-                elif hasattr(msg_obj, "document") and msg_obj.document:
-                    file_name = msg_obj.document.file_name if msg_obj.document.file_name else f"{message_id}.file"
-                    #print("This is a Document file!")
-
-                # Check if it's a video
-                elif hasattr(msg_obj, "video") and msg_obj.video:
-                    file_name = msg_obj.video.file_name if msg_obj.video.file_name else f"{message_id}.mp4"
-                    #print("This is a Video file!")
-
-                # Check if it's a photo
-                elif hasattr(msg_obj, "photo") and msg_obj.photo:
-                    file_name = getattr(msg_obj.photo, "file_name", f"{message_id}.jpg")
-                    #print("This is a Photo file!")
-
-                # Default case if none of the above
-                else:
-                    file_name = f"{message_id}.unknown"
-                    #print("This is an Unknown type of file.")
-
-                file_path = os.path.join(media_path, file_name)
-                msg_obj.download(file_path)
-                saved_files.append(file_path)
-
-                # Track media type
-                if msg_obj.photo:
-                    media_types.append("PHOTO")
-                elif msg_obj.video:
-                    media_types.append("VIDEO")
-                elif msg_obj.document:
-                    media_types.append("DOCUMENT")
-                else:
-                    media_types.append("OTHER")
-
-                print(f"Downloaded: {file_path}")
-
-            elif (msg_obj.web_page or msg_obj.media is None) and msg.get("text") and msg.get("text").strip():
-                entities = parse_entities_from_json(msg.get("messages_entities"), client=app)
-                # Handle web page previews by sending text + entities
-                app.send_message(
-                    chat_id=TARGET_CHANNEL,
-                    text=msg.get("text"),
-                    entities=entities  # preserves formatting
-                )
-                #print(f"Sent text/web page for message: {message_id}")
 
-        # Organize files by type
-        photos_videos = []
-        documents = []
+async def process_reloading(app, msg, message_ids, TRACKED_CHANNEL):
+    pinned = []     # Media store files this reload sends from disk, kept from eviction until it is done
+    try:
+        await reload_message(app, msg, message_ids, TRACKED_CHANNEL, pinned)
+    finally:
+        cache = get_media_cache()
+        if cache is not None and pinned:
+            cache.unpin(pinned)
+
+
+async def reload_message(app, msg, message_ids, TRACKED_CHANNEL, pinned):
+    channel_username = TRACKED_CHANNEL
+    media_path = os.path.join("media", str(channel_username))
+    os.makedirs(media_path, exist_ok=True)
+
+    # The whole album in one request, in the order of message_ids
+    msg_objs = await limiter.call(PRIORITY_PUBLISH, app.get_messages, chat_id=channel_username, message_ids=list(message_ids))
+
+    # Download media from messages, at most MEDIA_DOWNLOAD_CONCURRENCY parts at a time
+    semaphore = asyncio.Semaphore(MEDIA_DOWNLOAD_CONCURRENCY)
+    published = []      # Messages created in TARGET_CHANNEL, tracked at the end
+    downloads = []
+    media_types = []
+    unique_ids = []
+    for msg_obj in msg_objs:
+        if msg_obj.media and not msg_obj.web_page:  # skip web_page for downloading
+            downloads.append(asyncio.create_task(download_media(msg_obj, media_path, semaphore, pinned)))
+            media_types.append(media_kind(msg_obj))
+            unique_ids.append(media_unique_id(msg_obj))
+
+        elif (msg_obj.web_page or msg_obj.media is None) and msg.get("text") and msg.get("text").strip():
+            entities = parse_entities_from_json(msg.get("messages_entities"), client=app)
+            # Handle web page previews by sending text + entities
+            sent = await limiter.call(PRIORITY_PUBLISH, app.send_message,
+                chat_id=TARGET_CHANNEL,
+                text=msg.get("text"),
+                entities=entities  # preserves formatting
+            )
+            published.append(sent)
+            #print(f"Sent text/web page for message: {msg_obj.id}")
 
-        for file, m_type in zip(saved_files, media_types):
-            if m_type == "PHOTO":
-                photos_videos.append(InputMediaPhoto(file))
-            elif m_type == "VIDEO":
-                photos_videos.append(InputMediaVideo(file))
-            else:  # DOCUMENT or OTHER
-                documents.append(file)
+    try:
+        saved_files = await asyncio.gather(*downloads)
+    except BaseException:
+        for task in downloads:
+            task.cancel()
+        raise
+
+    # Organize files by type
+    photos_videos = []
+    photos_videos_ids = []
+    documents = []
+    documents_ids = []
+
+    for file, m_type, unique_id in zip(saved_files, media_types, unique_ids):
+        if m_type == "PHOTO":
+            photos_videos.append(InputMediaPhoto(file))
+            photos_videos_ids.append(unique_id)
+        elif m_type == "VIDEO":
+            photos_videos.append(InputMediaVideo(file))
+            photos_videos_ids.append(unique_id)
+        else:  # DOCUMENT or OTHER
+            documents.append(file)
+            documents_ids.append(unique_id)
 
+    try:
         # Send photos/videos as media group
         if photos_videos:
             entities = parse_entities_from_json(msg.get("messages_entities"), client=app)
@@ -498,10 +898,11 @@ def process_reloading(msg, message_ids, TRACKED_CHANNEL):
             #print("photos_videos: ", photos_videos)
 
             try:
-                app.send_media_group(
+                sent = await limiter.call(PRIORITY_PUBLISH, app.send_media_group,
                     chat_id=TARGET_CHANNEL,
                     media=photos_videos
                 )
+                published.extend(sent)
                 #print(f"Sent media group: {len(photos_videos)} items with caption")
             except MediaCaptionTooLong:
                 #print("Caption too long, sending text first then media group without caption")
@@ -510,150 +911,144 @@ def process_reloading(msg, message_ids, TRACKED_CHANNEL):
                 photos_videos[0].caption = None
                 photos_videos[0].parse_mode = None
                 photos_videos[0].caption_entities = None
-                app.send_media_group(chat_id=TARGET_CHANNEL, media=photos_videos)
+                sent = await limiter.call(PRIORITY_PUBLISH, app.send_media_group, chat_id=TARGET_CHANNEL, media=photos_videos)
                 #print(entities)
-                app.send_message(
+                # The text carries the caption, so it is the message tracked for edits
+                published.append(await limiter.call(PRIORITY_PUBLISH, app.send_message,
                     chat_id=TARGET_CHANNEL,
                     text=msg.get("text"),
                     entities=entities
-                )
-                message_ids = [message_ids[0]]
+                ))
                 #print(f"Sent media group: {len(photos_videos)} items without caption")
+            record_uploads(sent, photos_videos_ids)
 
         # Send documents sequentially
-        for doc in documents:
+        for doc, unique_id in zip(documents, documents_ids):
             entities = parse_entities_from_json(msg.get("messages_entities"), client=app)
             try:
-                app.send_document(
+                sent = await limiter.call(PRIORITY_PUBLISH, app.send_document,
                     chat_id=TARGET_CHANNEL,
                     document=doc,
                     caption=msg.get("text"),
                     caption_entities=entities
                 )
             except MediaCaptionTooLong:
-                app.send_document(chat_id=TARGET_CHANNEL, document=doc)
-                app.send_message(
+                sent = await limiter.call(PRIORITY_PUBLISH, app.send_document, chat_id=TARGET_CHANNEL, document=doc)
+                # The text carries the caption, so it is the message tracked for edits
+                published.append(await limiter.call(PRIORITY_PUBLISH, app.send_message,
                     chat_id=TARGET_CHANNEL,
                     text=msg.get("text"),
                     entities=entities
-                )
+                ))
+            else:
+                published.append(sent)
+            record_uploads([sent], [unique_id])
             #print(f"Sent document: {doc}")
+    except BadRequest:
+        # A stored file_id may have been refused, upload the files again on the next attempt
+        cache = get_media_cache()
+        if cache is not None:
+            cache.forget_uploads([u for u in unique_ids if u])
+        raise
+
+    # Call filter endpoint
+    filter_result = await asyncio.to_thread(request_filtering,
+        msg['user_id'],
+        msg['channel_id'],
+        msg['message_id']
+    )
+    #print(filter_result)
 
-        # Call filter endpoint
-        filter_result = request_filtering(
-            msg['user_id'],
-            msg['channel_id'],
-            msg['message_id']
-        )
-        #print(filter_result)
-
-        # Fetch latest messages from target channel
-        latest_messages = list(app.get_chat_history(
-            chat_id=TARGET_CHANNEL,
-            limit=len(message_ids)
-        ))
-
-        target_message = ",".join(str(m.id) for m in latest_messages)
-        #print(msg["message_id"])
-        #print(target_message)
+    # Track the mapping
+    tracking_result = await asyncio.to_thread(track_published, msg, str(TRACKED_CHANNEL), published)
+    #print(tracking_result)
 
-        # Track the mapping
-        tracking_result = request_tracking(
-            msg['user_id'],
-            str(TRACKED_CHANNEL),
-            msg['message_id'],
-            str(TARGET_CHANNEL),
-            target_message
-        )
-        #print(tracking_result)
+    #print(f"Reloading completed for messages: {msg['message_id']}")
 
-        #print(f"Reloading completed for messages: {msg['message_id']}")
+async def process_editing_reloading(app, msg, message_ids, target_message_id):
+    target_message_ids = sorted(convert_to_int_array(target_message_id))
 
-def process_editing_reloading(msg, message_ids, target_message_id):
-    with Client(SESSION_NAME, api_id=API_ID, api_hash=API_HASH) as app:
-        target_message_ids = sorted(convert_to_int_array(target_message_id))
+    # Ensure it's always a list
+    if isinstance(target_message_ids, int):
+        target_message_ids = [target_message_ids]
+    target_message = await limiter.call(PRIORITY_PUBLISH, app.get_messages, chat_id=TARGET_CHANNEL, message_ids=target_message_ids[0])
 
-        # Ensure it's always a list
-        if isinstance(target_message_ids, int):
-            target_message_ids = [target_message_ids]
-        target_message = app.get_messages(chat_id=TARGET_CHANNEL, message_ids=target_message_ids[0])
+    media = str(target_message.media) or ""
 
-        media = str(target_message.media) or ""
+    if media == "" or "MessageMediaType.WEB_PAGE" == media:
+        # Text-only (with or without web preview)
+        entities = parse_entities_from_json(msg.get("messages_entities"), client=app)
+        try:
+            await limiter.call(PRIORITY_PUBLISH, app.edit_message_text,
+                chat_id=TARGET_CHANNEL,
+                message_id=target_message.id,
+                text=msg.get("text"),
+                entities=entities
+            )
+            #print(f"Edited text for message: {target_message_ids[0]}")
+        except MessageNotModified:
+            print("Message not modified, skipping edit.")
+            # Continue with the next iteration or code
+    else:
+        entities = parse_entities_from_json(msg.get("messages_entities"), client=app)
 
-        if media == "" or "MessageMediaType.WEB_PAGE" == media:
-            # Text-only (with or without web preview)
-            entities = parse_entities_from_json(msg.get("messages_entities"), client=app)
+        # Check if the target message has a caption
+        if not target_message.caption:  # No caption exists
+            # Edit as text
             try:
-                app.edit_message_text(
+                await limiter.call(PRIORITY_PUBLISH, app.edit_message_text,
                     chat_id=TARGET_CHANNEL,
                     message_id=target_message.id,
                     text=msg.get("text"),
                     entities=entities
                 )
-                #print(f"Edited text for message: {target_message_ids[0]}")
+                #print(f"Edited text for message without caption: {target_message.id}")
             except MessageNotModified:
                 print("Message not modified, skipping edit.")
                 # Continue with the next iteration or code
         else:
-            entities = parse_entities_from_json(msg.get("messages_entities"), client=app)
-
-            # Check if the target message has a caption
-            if not target_message.caption:  # No caption exists
-                # Edit as text
-                try:
-                    app.edit_message_text(
-                        chat_id=TARGET_CHANNEL,
-                        message_id=target_message.id,
-                        text=msg.get("text"),
-                        entities=entities
-                    )
-                    #print(f"Edited text for message without caption: {target_message.id}")
-                except MessageNotModified:
-                    print("Message not modified, skipping edit.")
-                    # Continue with the next iteration or code
-            else:
-                # Attempt to edit the caption
-                caption_text = msg.get("text")
-                try:
-                    app.edit_message_caption(
-                        chat_id=TARGET_CHANNEL,
-                        message_id=target_message.id,
-                        caption=caption_text,
-                        caption_entities=entities
-                    )
-                    #print(f"Edited caption for media message: {target_message.id}")
-                except MediaCaptionTooLong:
-                    #print(f"Caption too long for message {target_message.id}, truncating to 1024 chars")
-                    truncated_caption = caption_text[:1024]
-                    app.edit_message_caption(
-                        chat_id=TARGET_CHANNEL,
-                        message_id=target_message.id,
-                        caption=truncated_caption,
-                        caption_entities=entities
-                    )
-                    #print(f"Edited caption (truncated) for media message: {target_message.id}")
-                except MessageNotModified:
-                    print("Message not modified, skipping edit.")
-                    # Continue with the next iteration or code
+            # Attempt to edit the caption
+            caption_text = msg.get("text")
+            try:
+                await limiter.call(PRIORITY_PUBLISH, app.edit_message_caption,
+                    chat_id=TARGET_CHANNEL,
+                    message_id=target_message.id,
+                    caption=caption_text,
+                    caption_entities=entities
+                )
+                #print(f"Edited caption for media message: {target_message.id}")
+            except MediaCaptionTooLong:
+                #print(f"Caption too long for message {target_message.id}, truncating to 1024 chars")
+                truncated_caption = caption_text[:1024]
+                await limiter.call(PRIORITY_PUBLISH, app.edit_message_caption,
+                    chat_id=TARGET_CHANNEL,
+                    message_id=target_message.id,
+                    caption=truncated_caption,
+                    caption_entities=entities
+                )
+                #print(f"Edited caption (truncated) for media message: {target_message.id}")
+            except MessageNotModified:
+                print("Message not modified, skipping edit.")
+                # Continue with the next iteration or code
 
-            # Call filter endpoint
-        filter_result = request_filtering(
-            msg['user_id'],
-            msg['channel_id'],
-            msg['message_id']
-        )
-        #print(filter_result)
+        # Call filter endpoint
+    filter_result = await asyncio.to_thread(request_filtering,
+        msg['user_id'],
+        msg['channel_id'],
+        msg['message_id']
+    )
+    #print(filter_result)
 
-        #print(f"Editing completed for messages: {message_ids}")
+    #print(f"Editing completed for messages: {message_ids}")
 
 def main_loop():
     for CHANNEL_USERNAME in TRACKED_CHANNELS:
         while True:
             # Get messages from DB
-            pending = fetch_one_message(user_id, CHANNEL_USERNAME)
+            pending = fetch_pending_messages(user_id, CHANNEL_USERNAME, SCORING_BATCH_SIZE)
 
             # Make sure we actually got something
-            messages = pending.get("messages", [])
+            messages = (pending or {}).get("messages", [])
             if not messages:
                 print("No new messages.")
             else:
@@ -664,128 +1059,198 @@ def main_loop():
                     print(score)  # 25
             time.sleep(3)  # poll every 3s
 
-
-def main_once():
-    for channel in TRACKED_CHANNELS:
-        # Get messages from DB
-        pending = fetch_one_message(user_id, channel)
-        messages = pending.get("messages", [])
-        #print(messages)
-
-        if not messages:
-            print(f"No new messages in channel {channel}")
+def score_messages(messages) -> list:
+    """
+    Score many pending messages. Obvious cases are decided by the pre-filter, the rest are looked up
+    in the verdict cache (exact text or near duplicate) and only misses go to the LLM in a single batch request.
+    Returns scores in the order of messages, messages without text get score 0.
+    """
+    scores = [0] * len(messages)
+    cache = get_verdict_cache()
+    classifier = get_prefilter()
+    to_score = []  # (index, cache key, formatted text) of messages the LLM has to see
+    verdicts = {}  # (user_id, channel_id) -> LLM scores to record
+    for i, msg in enumerate(messages):
+        if not msg.get('text'):  # Only run if 'text' is not empty or None
             continue
-        print(f"Processing messages in channel {channel}")
-        for msg in messages:
-            if msg.get('text'):  # Only run if 'text' is not empty or None
-                result = analyze_message_with_llm(msg)
-                #print(f"[{msg['channel_id']}] {msg['message_id']} → {result}")
-                score = int(parse_ad_score(result) or 0)
-                #print(score)
-                #print(msg['status'])
-            else:
-                #print(f"[{msg['channel_id']}] {msg['message_id']} → Skipped, no text, assigning score 0")
-                score = 0
-
-            message_ids = convert_to_int_array(msg["message_id"])
-            if isinstance(message_ids, int):
-                message_ids = [message_ids]  # wrap single int in a list
-
-            # Forward messages if needed
-            if msg['status'] == "new" and Scoring_messaging_gap > int(score):
-                if TRANSFERING_METHOD == "FORWARDING":
-                    process_forwarding(msg, message_ids, channel)
-                elif TRANSFERING_METHOD == "RELOADING":
-                    process_reloading(msg, message_ids, channel)
-                elif TRANSFERING_METHOD == "SMART":
-                    if msg['is_protected']:
-                        # If the message is protected, use RELOADING
-                        process_reloading(msg, message_ids, channel)
-                    elif not msg['is_protected']:
-                        # If the message is not protected, forward it
-                        process_forwarding(msg, message_ids, channel)
-            # Other conditions
-            elif msg['status'] == "edited" and Scoring_messaging_gap > int(score):
-                tracking_check_result = request_tracking_check(
-                    msg['user_id'],
-                    msg['channel_id'],
-                    msg['message_id']
-                )
-                #print(tracking_check_result)
-
-                if tracking_check_result.get("status") == "not_found":
-                    if TRANSFERING_METHOD == "FORWARDING":
-                        process_forwarding(msg, message_ids, channel)
-                    elif TRANSFERING_METHOD == "RELOADING":
-                        process_reloading(msg, message_ids, channel)
-                    elif TRANSFERING_METHOD == "SMART":
-                        if msg['is_protected']:
-                            # If the message is protected, use RELOADING
-                            process_reloading(msg, message_ids, channel)
-                        elif not msg['is_protected']:
-                            # If the message is not protected, forward it
-                            process_forwarding(msg, message_ids, channel)
-                else:
-                    if TRANSFERING_METHOD == "FORWARDING":
-                        filter_result = request_filtering(
-                            msg['user_id'],
-                            msg['channel_id'],
-                            msg['message_id']
-                        )
-                        #print(filter_result)
-                    elif TRANSFERING_METHOD == "RELOADING":
-                        process_editing_reloading(msg, message_ids, tracking_check_result.get("target_message_id"))
-                    elif TRANSFERING_METHOD == "SMART":
-                        if msg['is_protected']:
-                            # If the message is protected, use RELOADING
-                            process_editing_reloading(msg, message_ids,
-                                                      tracking_check_result.get("target_message_id"))
-                        elif not msg['is_protected']:
-                            # If the message is not protected, forward it
-                            filter_result = request_filtering(
-                                msg['user_id'],
-                                msg['channel_id'],
-                                msg['message_id']
-                            )
-            elif msg['status'] == "new" and Scoring_messaging_gap <= int(score):
-                filter_result = request_filtering(
+        if classifier:
+            outcome = classifier(msg)
+            if outcome != ASK:
+                scores[i] = OUTCOME_SCORES[outcome]
+                continue
+        text = format_message_text(msg)
+        key, cached = cache.lookup(text) if cache else (None, None)
+        if cached is not None:
+            scores[i] = cached
+            verdicts.setdefault((msg['user_id'], msg['channel_id']), []).append(
+                {"message_id": msg['message_id'], "score": cached})
+        else:
+            to_score.append((i, key, text))
+
+    if len(to_score) == 1:
+        results = [analyze_message_with_llm(messages[to_score[0][0]])]
+    elif to_score:
+        results = analyze_messages_with_llm([messages[i] for i, _, _ in to_score])
+    else:
+        results = []
+
+    for (i, key, text), result in zip(to_score, results):
+        #print(f"[{messages[i]['channel_id']}] {messages[i]['message_id']} → {result}")
+        score = parse_ad_score(result)
+        scores[i] = int(score or 0)
+        if score is not None:  # Do not remember answers without a score tag
+            if cache:
+                cache.put(key, score, text)
+            verdicts.setdefault((messages[i]['user_id'], messages[i]['channel_id']), []).append(
+                {"message_id": messages[i]['message_id'], "score": score})
+
+    for (msg_user_id, channel_id), channel_scores in verdicts.items():
+        request_scores(msg_user_id, channel_id, channel_scores)
+    return scores
+
+async def publish_message(app, msg, score, channel):
+    """
+    Act on a scored message: forward/reload it, edit or delete its copy in the target channel,
+    or just mark it as filtered, depending on its status and score.
+    """
+    message_ids = convert_to_int_array(msg["message_id"])
+    if isinstance(message_ids, int):
+        message_ids = [message_ids]  # wrap single int in a list
+
+    # Forward messages if needed
+    if msg['status'] == "new" and Scoring_messaging_gap > int(score):
+        if TRANSFERING_METHOD == "FORWARDING":
+            await forward_message(app, msg, message_ids, channel)
+        elif TRANSFERING_METHOD == "RELOADING":
+            await process_reloading(app, msg, message_ids, channel)
+        elif TRANSFERING_METHOD == "SMART":
+            if msg['is_protected']:
+                # If the message is protected, use RELOADING
+                await process_reloading(app, msg, message_ids, channel)
+            elif not msg['is_protected']:
+                # If the message is not protected, forward it
+                await forward_message(app, msg, message_ids, channel)
+    # Other conditions
+    elif msg['status'] == "edited" and Scoring_messaging_gap > int(score):
+        tracking_check_result = await asyncio.to_thread(request_tracking_check,
+            msg['user_id'],
+            msg['channel_id'],
+            msg['message_id']
+        )
+        #print(tracking_check_result)
+
+        if tracking_check_result.get("status") == "not_found":
+            if TRANSFERING_METHOD == "FORWARDING":
+                await forward_message(app, msg, message_ids, channel)
+            elif TRANSFERING_METHOD == "RELOADING":
+                await process_reloading(app, msg, message_ids, channel)
+            elif TRANSFERING_METHOD == "SMART":
+                if msg['is_protected']:
+                    # If the message is protected, use RELOADING
+                    await process_reloading(app, msg, message_ids, channel)
+                elif not msg['is_protected']:
+                    # If the message is not protected, forward it
+                    await forward_message(app, msg, message_ids, channel)
+        else:
+            if TRANSFERING_METHOD == "FORWARDING":
+                filter_result = await asyncio.to_thread(request_filtering,
                     msg['user_id'],
                     msg['channel_id'],
                     msg['message_id']
                 )
                 #print(filter_result)
-            elif msg['status'] == "edited" and Scoring_messaging_gap <= int(score):
-                tracking_check_result = request_tracking_check(
-                    msg['user_id'],
-                    msg['channel_id'],
-                    msg['message_id']
-                )
-                #print(tracking_check_result)
-
-                if tracking_check_result.get("status") == "not_found":
-                    filter_result = request_filtering(
+            elif TRANSFERING_METHOD == "RELOADING":
+                await process_editing_reloading(app, msg, message_ids, tracking_check_result.get("target_message_id"))
+            elif TRANSFERING_METHOD == "SMART":
+                if msg['is_protected']:
+                    # If the message is protected, use RELOADING
+                    await process_editing_reloading(app, msg, message_ids,
+                                                    tracking_check_result.get("target_message_id"))
+                elif not msg['is_protected']:
+                    # If the message is not protected, forward it
+                    filter_result = await asyncio.to_thread(request_filtering,
                         msg['user_id'],
                         msg['channel_id'],
                         msg['message_id']
                     )
-                    #print(filter_result)
-                else:
-                    target_message_ids = convert_to_int_array(tracking_check_result.get("target_message_id"))
-                    if isinstance(target_message_ids, int):
-                        target_message_ids = [target_message_ids]  # wrap single int in a list
-                    with Client(SESSION_NAME, api_id=API_ID, api_hash=API_HASH) as app:
-                        app.delete_messages(
-                            chat_id=TARGET_CHANNEL,
-                            message_ids=target_message_ids
-                        )
-                    filter_result = request_filtering(
-                        msg['user_id'],
-                        msg['channel_id'],
-                        msg['message_id']
-                    )
-                    #print(filter_result)
+    elif msg['status'] == "new" and Scoring_messaging_gap <= int(score):
+        filter_result = await asyncio.to_thread(request_filtering,
+            msg['user_id'],
+            msg['channel_id'],
+            msg['message_id']
+        )
+        #print(filter_result)
+    elif msg['status'] == "edited" and Scoring_messaging_gap <= int(score):
+        tracking_check_result = await asyncio.to_thread(request_tracking_check,
+            msg['user_id'],
+            msg['channel_id'],
+            msg['message_id']
+        )
+        #print(tracking_check_result)
+
+        if tracking_check_result.get("status") == "not_found":
+            filter_result = await asyncio.to_thread(request_filtering,
+                msg['user_id'],
+                msg['channel_id'],
+                msg['message_id']
+            )
+            #print(filter_result)
+        else:
+            target_message_ids = convert_to_int_array(tracking_check_result.get("target_message_id"))
+            if isinstance(target_message_ids, int):
+                target_message_ids = [target_message_ids]  # wrap single int in a list
+            await limiter.call(PRIORITY_PUBLISH, app.delete_messages,
+                chat_id=TARGET_CHANNEL,
+                message_ids=target_message_ids
+            )
+            filter_result = await asyncio.to_thread(request_filtering,
+                msg['user_id'],
+                msg['channel_id'],
+                msg['message_id']
+            )
+            #print(filter_result)
+
+
+async def main_once(app):
+    """
+    Drain the pending messages of all tracked channels, claiming up to SCORING_BATCH_SIZE messages
+    of one channel per turn. Channels take turns (round-robin) until none has work left,
+    so a burst in one channel does not hold back the others.
+    """
+    channels = list(TRACKED_CHANNELS)
+    while channels:
+        for channel in list(channels):
+            # Lease messages from DB, messages that are not acked stay leased until they expire
+            claimed = await asyncio.to_thread(claim_messages, user_id, channel, SCORING_BATCH_SIZE)
+            messages = (claimed or {}).get("messages", [])
+            #print(messages)
+
+            if not messages:
+                print(f"No new messages in channel {channel}")
+                channels.remove(channel)
+                continue
+            print(f"Processing {len(messages)} messages in channel {channel}")
+            try:
+                scores = await asyncio.to_thread(score_messages, messages)
+            except Exception:
+                await asyncio.to_thread(release_messages, user_id, channel, [msg["message_id"] for msg in messages])
+                raise
+            # Scoring may have taken most of the lease, renew it for publishing
+            await asyncio.to_thread(renew_messages, user_id, channel, [msg["message_id"] for msg in messages])
+            for msg, score in zip(messages, scores):
+                try:
+                    await publish_message(app, msg, score, channel)
+                except Exception as e:
+                    print(f"Error publishing message {msg['message_id']}: {e}")
+                    await asyncio.to_thread(release_messages, user_id, channel, [msg["message_id"]])
+    await forward_batcher.flush_all(app)
     return
 
 
+async def main():
+    async with Client(SESSION_NAME, api_id=API_ID, api_hash=API_HASH, sleep_threshold=0) as app:
+        await main_once(app)
+
+
 if __name__ == "__main__":
-    main_once()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
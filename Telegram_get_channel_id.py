@@ -2,6 +2,7 @@ from pyrogram import Client
 import requests
 import asyncio
 import config
+from Telegram_limiter import limiter, PRIORITY_FETCH
 
 SESSION_NAME = config.SESSION_NAME
 API_ID = config.API_ID       # from my.telegram.org
@@ -9,8 +10,8 @@ API_HASH = config.API_HASH
 CHANNEL_LINK = config.CHANNEL_LINK
 
 async def get_chat_id():
-    async with Client(SESSION_NAME, API_ID, API_HASH) as app:
-        chat = await app.get_chat(CHANNEL_LINK)
+    async with Client(SESSION_NAME, API_ID, API_HASH, sleep_threshold=0) as app:
+        chat = await limiter.call(PRIORITY_FETCH, app.get_chat, CHANNEL_LINK)
         print("Chat ID:", chat.id)          # Numeric ID you can use
         print("Chat title:", chat.title)    # Optional, for verification
         return chat.id
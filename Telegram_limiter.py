@@ -0,0 +1,125 @@
+# Telegram_limiter.py
+import asyncio
+import heapq
+import itertools
+import time
+from pyrogram.errors import FloodWait
+import config
+
+# Lower value is served first when calls wait for the limiter
+PRIORITY_PUBLISH = 0    # forward, send, edit, delete, download for reloading
+PRIORITY_FETCH = 1      # fetching new messages
+PRIORITY_SCOUT = 2      # scouting edits
+
+
+class TelegramRateLimiter:
+    """
+    Token bucket shared by every Telegram call of the process.
+
+    Waiting calls are served by priority (publishing before fetching before scouting), FIFO within
+    a priority. A FloodWait blocks the whole bucket for the requested time and halves the rate;
+    every successful call raises the rate again by a small step up to max_rate (AIMD), so the rate
+    settles just under what Telegram tolerates for this account.
+    """
+
+    def __init__(self, rate=config.TELEGRAM_RATE, max_rate=config.TELEGRAM_RATE_MAX,
+                 min_rate=config.TELEGRAM_RATE_MIN, burst=config.TELEGRAM_BURST,
+                 rate_step=config.TELEGRAM_RATE_STEP):
+        self.rate = rate                    # tokens per second
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.rate_step = rate_step
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiters = []                   # heap of (priority, seq)
+        self.seq = itertools.count()
+        self.cond = asyncio.Condition()
+        self.calls = 0
+        self.flood_waits = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _wait_time(self, cost):
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    async def acquire(self, priority=PRIORITY_FETCH, cost=1):
+        cost = min(cost, self.burst)
+        me = (priority, next(self.seq))
+        async with self.cond:
+            heapq.heappush(self.waiters, me)
+            try:
+                while True:
+                    if self.waiters[0] == me:
+                        wait = self._wait_time(cost)
+                        if wait <= 0:
+                            heapq.heappop(self.waiters)
+                            self.tokens -= cost
+                            self.cond.notify_all()
+                            return
+                        try:
+                            # Woken early when a higher priority call arrives
+                            await asyncio.wait_for(self.cond.wait(), wait)
+                        except asyncio.TimeoutError:
+                            pass
+                    else:
+                        await self.cond.wait()
+            except BaseException:
+                if me in self.waiters:
+                    self.waiters.remove(me)
+                    heapq.heapify(self.waiters)
+                    self.cond.notify_all()
+                raise
+
+    def on_flood(self, seconds):
+        self.flood_waits += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        print(f"FloodWait of {seconds}s, Telegram calls paused, rate lowered to {self.rate:.2f}/s")
+
+    def on_success(self):
+        self.calls += 1
+        self.rate = min(self.max_rate, self.rate + self.rate_step)
+
+    async def call(self, priority, fn, *args, retries=config.TELEGRAM_FLOOD_RETRIES, cost=1, **kwargs):
+        """Await fn(*args, **kwargs) under the limiter, waiting out FloodWait and retrying."""
+        for attempt in range(retries + 1):
+            await self.acquire(priority, cost)
+            try:
+                result = await fn(*args, **kwargs)
+            except FloodWait as e:
+                self.on_flood(e.value)
+                if attempt == retries:
+                    raise
+                continue
+            self.on_success()
+            return result
+
+    async def history(self, priority, app, chat_id, limit, retries=config.TELEGRAM_FLOOD_RETRIES):
+        """get_chat_history as a list, one token per page of 100 messages."""
+        async def collect():
+            return [m async for m in app.get_chat_history(chat_id=chat_id, limit=limit)]
+        return await self.call(priority, collect, retries=retries, cost=max(1, -(-limit // 100)))
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "tokens": self.tokens,
+            "waiting": len(self.waiters),
+            "calls": self.calls,
+            "flood_waits": self.flood_waits,
+            "blocked_for": max(0.0, self.blocked_until - time.monotonic()),
+        }
+
+
+limiter = TelegramRateLimiter()
@@ -0,0 +1,88 @@
+# Telegram_session.py
+import asyncio
+from pyrogram import Client
+from pyrogram.handlers import ConnectHandler
+import config
+
+
+class SharedTelegramClient:
+    """
+    One long-lived Pyrogram Client shared by ingestion and publishing.
+
+    Only this object opens the session file, and start/stop/reconnect all go through one lock,
+    so the SQLite session storage is never opened twice or touched by two restarts at once.
+    Pyrogram reconnects dropped sockets on its own; the watchdog restarts the client
+    when it ends up fully disconnected (e.g. start failed while the network was down).
+
+    Pyrogram drops update handlers on stop(), so handlers are registered here and re-added
+    after every start. Callbacks added with on_connect() run on every (re)connect of the main session.
+    """
+
+    def __init__(self, session_name=config.SESSION_NAME, api_id=config.API_ID, api_hash=config.API_HASH):
+        # sleep_threshold=0: Pyrogram raises every FloodWait instead of sleeping through short ones,
+        # so Telegram_limiter sees them all and lowers the rate
+        self.app = Client(session_name, api_id=api_id, api_hash=api_hash, sleep_threshold=0)
+        self._lock = asyncio.Lock()
+        self.reconnects = 0
+        self.handlers = []           # (handler, group) pairs
+        self.connect_callbacks = []
+        self.app.add_handler(ConnectHandler(self._on_connect))
+
+    async def start(self, retry_interval=5):
+        async with self._lock:
+            while not self.app.is_connected:
+                try:
+                    await self.app.start()
+                    for handler, group in self.handlers:
+                        self.app.add_handler(handler, group)
+                    me = await self.app.get_me()
+                    print(f"✅ Telegram client started as {me.first_name}")
+                except (ConnectionError, OSError) as e:
+                    print(f"❌ Could not start Telegram client: {e}, retrying in {retry_interval}s")
+                    await asyncio.sleep(retry_interval)
+        return self.app
+
+    async def stop(self):
+        async with self._lock:
+            if self.app.is_connected:
+                await self.app.stop()
+
+    async def reconnect(self):
+        async with self._lock:
+            try:
+                if self.app.is_connected:
+                    await self.app.stop()
+            except Exception as e:
+                print(f"Error while stopping Telegram client: {e}")
+            self.reconnects += 1
+        return await self.start()
+
+    def add_handler(self, handler, group=0):
+        self.handlers.append((handler, group))
+        if self.app.is_connected:
+            self.app.add_handler(handler, group)
+
+    def on_connect(self, callback):
+        self.connect_callbacks.append(callback)
+
+    async def _on_connect(self, client, session):
+        if getattr(session, "is_media", False):
+            return  # Download/upload sessions to other DCs
+        for callback in self.connect_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in Telegram connect callback: {e}")
+
+    async def get(self):
+        """Return the started client, starting it first if needed."""
+        if not self.app.is_connected:
+            await self.start()
+        return self.app
+
+    async def watchdog(self, interval=30):
+        while True:
+            await asyncio.sleep(interval)
+            if not self.app.is_connected:
+                print("Telegram client disconnected, reconnecting")
+                await self.reconnect()
@@ -1,9 +1,12 @@
-from pyrogram import Client
+from pyrogram import Client, filters
+from pyrogram.handlers import MessageHandler, EditedMessageHandler
+from pyrogram.errors import UserNotParticipant
 from collections import defaultdict
 import requests
 import asyncio
 import json
 import config
+from Telegram_limiter import limiter, PRIORITY_FETCH, PRIORITY_SCOUT
 
 SESSION_NAME = config.SESSION_NAME
 API_ID = config.API_ID
@@ -11,6 +14,8 @@ API_HASH = config.API_HASH
 TRACKED_CHANNELS = config.TRACKED_CHANNELS
 NUM_MESSAGES = config.NUM_MESSAGES
 NUM_MESSAGES_TO_SCOUT = config.NUM_MESSAGES_TO_SCOUT
+MEDIA_GROUP_WAIT = config.MEDIA_GROUP_WAIT
+INGEST_PARALLEL_CHANNELS = config.INGEST_PARALLEL_CHANNELS
 database_ipaddress = config.database_ipaddress
 database_port = config.database_port
 user_id = config.user_id
@@ -25,7 +30,8 @@ except requests.exceptions.RequestException as e:
     print(f"❌ Could not reach database server: {e}")
     response_data = None
 
-messages_url = f"{base_url}/messages/"
+messages_batch_url = f"{base_url}/messages/batch"
+updates_batch_url = f"{base_url}/apply_updates/batch"
 
 def scout_messages(messages):
     """
@@ -122,27 +128,37 @@ def serialize_entities(entities):
         result.append(entity_dict)
     return json.dumps(result)
 
-async def scout_edits(CHANNEL_USERNAME):
-    async with Client(SESSION_NAME, API_ID, API_HASH) as app:
-        messages = []
-        async for msg in app.get_chat_history(CHANNEL_USERNAME, limit=NUM_MESSAGES_TO_SCOUT):
-            text = getattr(msg, "caption", None) or getattr(msg, "text", None)
-            entities = getattr(msg, "caption_entities", None) or getattr(msg, "entities", None)
-            entities_serialized = serialize_entities(entities)
-            messages.append({
-                "message_id": str(msg.id),
-                "message_media_group_id": str(msg.media_group_id) if msg.media_group_id else None,
-                "message_date": str(msg.date),
-                "message_edit_date": str(msg.edit_date) if msg.edit_date else None,
-                "messages_entities": entities_serialized if entities_serialized else None,
-                "text": text or "",
-            })
+def prepare_update_for_db(msg):
+    """
+    Build the EditedMessage dict (see SQLite_database.py) for a Telegram message.
+    """
+    text = getattr(msg, "caption", None) or getattr(msg, "text", None)
+    entities = getattr(msg, "caption_entities", None) or getattr(msg, "entities", None)
+    entities_serialized = serialize_entities(entities)
+    return {
+        "message_id": str(msg.id),
+        "message_media_group_id": str(msg.media_group_id) if msg.media_group_id else None,
+        "message_date": str(msg.date),
+        "message_edit_date": str(msg.edit_date) if msg.edit_date else None,
+        "messages_entities": entities_serialized if entities_serialized else None,
+        "text": text or "",
+    }
 
-    # Ask DB what it already has
+def fetch_update_status(CHANNEL_USERNAME, limit):
+    """
+    Ask DB what it already has for the channel (latest `limit` rows by message date).
+    """
     response = requests.get(
-        f"http://{database_ipaddress}:{database_port}/update_status/{user_id}/{CHANNEL_USERNAME}?limit={NUM_MESSAGES_TO_SCOUT}"
+        f"http://{database_ipaddress}:{database_port}/update_status/{user_id}/{CHANNEL_USERNAME}?limit={limit}"
     )
-    db_messages = response.json()["updates"]
+    return response.json()["updates"]
+
+async def scout_edits(app, CHANNEL_USERNAME):
+    history = await limiter.history(PRIORITY_SCOUT, app, CHANNEL_USERNAME, NUM_MESSAGES_TO_SCOUT)
+    messages = [prepare_update_for_db(msg) for msg in history]
+
+    # Ask DB what it already has
+    db_messages = await asyncio.to_thread(fetch_update_status, CHANNEL_USERNAME, NUM_MESSAGES_TO_SCOUT)
 
     # Normalize both sides
     tg_lookup = normalize_messages(messages)
@@ -171,22 +187,16 @@ async def scout_edits(CHANNEL_USERNAME):
 
     return updates
 # --- FUNCTION TO FETCH MESSAGES ---
-async def fetch_messages(CHANNEL_USERNAME):
+async def fetch_messages(app, CHANNEL_USERNAME):
 
     messages_by_group = defaultdict(list)
     single_messages = []
     filtered_messages = []
 
-    async with Client(SESSION_NAME, API_ID, API_HASH) as app:
-        # Fetch messages once
-        messages = []
-        async for msg in app.get_chat_history(CHANNEL_USERNAME, limit=NUM_MESSAGES):
-            messages.append(msg)
+    # Fetch messages once
+    messages = await limiter.history(PRIORITY_FETCH, app, CHANNEL_USERNAME, NUM_MESSAGES)
 
-    response = requests.get(
-        f"http://{database_ipaddress}:{database_port}/update_status/{user_id}/{CHANNEL_USERNAME}?limit={NUM_MESSAGES+20}"
-    )
-    db_messages = response.json()["updates"]
+    db_messages = await asyncio.to_thread(fetch_update_status, CHANNEL_USERNAME, NUM_MESSAGES + 20)
     db_keys = set()
     for m in db_messages:
         key = m["message_media_group_id"] or m["message_id"]
@@ -216,25 +226,6 @@ async def fetch_messages(CHANNEL_USERNAME):
 
     return messages_by_group, single_messages
 
-def prepare_message_for_db(msg):
-    entities = getattr(msg, "caption_entities", None) or getattr(msg, "entities", None)
-    return {
-        "message_id": str(msg.id),
-        "message_media_group_id": str(msg.media_group_id) if msg.media_group_id else None,
-        "user_id": user_id,
-        "channel_id": msg.chat.username or str(msg.chat.id),
-        "message_media": str(msg.media) if msg.media else None,
-        "message_date": str(msg.date),
-        "message_edit_date": str(msg.edit_date) if msg.edit_date else None,
-        "message_forward_from": None,
-        "message_forward_from_chat": None,
-        "message_reply_to_message_id": msg.reply_to_message_id if msg.reply_to_message_id else None,
-        "messages_entities": serialize_entities(entities) if entities else None,
-        "text": msg.text or "",
-        "status": "new",
-        "is_protected": msg.has_protected_content
-    }
-
 def prepare_messages_for_db(all_messages, messages_by_group):
     """
     Prepare message dicts for database insertion.
@@ -315,16 +306,38 @@ def prepare_messages_for_db(all_messages, messages_by_group):
 
     return message_dicts
 
-def push_message_to_db(message_dict):
+def push_messages_to_db(message_dicts):
+    """
+    Push a list of message dictionaries to the FastAPI database server in one request (one transaction).
+    """
+    if not message_dicts:
+        return None
+    try:
+        response = requests.post(messages_batch_url, json=message_dicts)
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Failed to push {len(message_dicts)} messages: {e}")
+        return None
+
+def updates_payload(updates_dict, CHANNEL_USERNAME):
+    return {
+        "user_id": user_id,
+        "channel_id": str(CHANNEL_USERNAME),
+        "unknown": updates_dict.get("unknown", []),
+        "edited": updates_dict.get("edited", [])
+    }
+
+def push_updates_batch_to_db(payloads):
     """
-    Push a single message dictionary to the FastAPI database server.
+    Push the updates of many channels (updates_payload dicts) in one request (one transaction).
     """
-    #print(message_dict)
+    if not payloads:
+        return None
     try:
-        response = requests.post(messages_url, json=message_dict)
+        response = requests.post(updates_batch_url, json=payloads, timeout=30)
         return response.json()
     except requests.exceptions.RequestException as e:
-        print(f"❌ Failed to push message: {e}")
+        print(f"❌ Failed to push updates of {len(payloads)} channels: {e}")
         return None
 
 def push_updates_to_db(updates_dict, CHANNEL_USERNAME):
@@ -348,92 +361,200 @@ def push_updates_to_db(updates_dict, CHANNEL_USERNAME):
     except requests.exceptions.RequestException as e:
         print(f"❌ Request failed: {e}")
 
-async def new_message_taker():
-    for channel in TRACKED_CHANNELS:
-        # 0. Fetch messages
-        messages_by_group, single_messages = await fetch_messages(channel)
-
-        if messages_by_group or single_messages:
-            # 1. Combine all messages
-            all_messages = []
-            for group_msgs in messages_by_group.values():
-                all_messages.extend(group_msgs)
-            all_messages.extend(single_messages)
-
-            # 2. Sort by message ID
-            all_messages.sort(key=lambda msg: msg.id)
-            # print(all_messages)
-            if all_messages:
-                first_msg = all_messages[0]
-                mgid = getattr(first_msg, "media_group_id", None)
-
-                if mgid is not None:
-                    # Find all messages with the same media_group_id
-                    group_msgs = [msg for msg in all_messages if getattr(msg, "media_group_id", None) == mgid]
-
-                    # Remove first_msg from all_messages
-                    all_messages = [msg for msg in all_messages if msg not in group_msgs or msg == first_msg]
-
-            # 3. Push to DB
-            msg_dicts = prepare_messages_for_db(all_messages, messages_by_group)
-            #print(f"Channel {channel}: {len(msg_dicts)} messages found in this loop")
-            for msg in msg_dicts:
-                # print(msg)
-                #print(msg.get("message_edit_date"))
-                #print(msg.get("text"))
-                result = push_message_to_db(msg)
-                # print(result)
-
-async def edits_taker():
+async def collect_new_messages(app, channel):
+    """
+    Fetch new messages of a single channel and return them as DB rows, without storing them.
+    """
+    # 0. Fetch messages
+    messages_by_group, single_messages = await fetch_messages(app, channel)
+
+    if not (messages_by_group or single_messages):
+        return []
+
+    # 1. Combine all messages
+    all_messages = []
+    for group_msgs in messages_by_group.values():
+        all_messages.extend(group_msgs)
+    all_messages.extend(single_messages)
+
+    # 2. Sort by message ID
+    all_messages.sort(key=lambda msg: msg.id)
+    # print(all_messages)
+    if all_messages:
+        first_msg = all_messages[0]
+        mgid = getattr(first_msg, "media_group_id", None)
+
+        if mgid is not None:
+            # Find all messages with the same media_group_id
+            group_msgs = [msg for msg in all_messages if getattr(msg, "media_group_id", None) == mgid]
+
+            # Remove first_msg from all_messages
+            all_messages = [msg for msg in all_messages if msg not in group_msgs or msg == first_msg]
+
+    # 3. Prepare DB rows
+    return prepare_messages_for_db(all_messages, messages_by_group)
+
+# --- SWEEPS OVER ALL CHANNELS ---
+async def run_sweep(fn, app, channels):
+    """
+    Run fn(app, channel) for all channels, at most INGEST_PARALLEL_CHANNELS at a time.
+    Telegram calls inside go through the shared limiter, which waits out FloodWait for all of them,
+    so the sweep slows down to what Telegram allows.
+    Returns {channel: result} of the channels that succeeded.
+    """
+    semaphore = asyncio.Semaphore(INGEST_PARALLEL_CHANNELS)
+
+    async def one(channel):
+        async with semaphore:
+            return await fn(app, channel)
+
+    results = await asyncio.gather(*(one(channel) for channel in channels), return_exceptions=True)
+    done = {}
+    for channel, result in zip(channels, results):
+        if isinstance(result, Exception):
+            print(f"Error in {fn.__name__} for {channel}: {result}")
+        else:
+            done[channel] = result
+    return done
+
+async def sweep_new_messages(app, channels=TRACKED_CHANNELS):
+    """
+    Fetch new messages of all channels concurrently and store them with a single batch insert.
+    Returns {channel: number of rows fetched}, all zeros when the DB already had every row
+    (e.g. push ingestion stored them while the sweep ran).
+    """
+    rows = await run_sweep(collect_new_messages, app, channels)
+    all_rows = [row for channel_rows in rows.values() for row in channel_rows]
+    if all_rows:
+        result = await asyncio.to_thread(push_messages_to_db, all_rows)
+        if result and result.get("inserted") == 0:
+            return {channel: 0 for channel in rows}
+    return {channel: len(channel_rows) for channel, channel_rows in rows.items()}
+
+async def sweep_edits(app, channels=TRACKED_CHANNELS):
+    """
+    Scout all channels for edits concurrently and store them in a single request.
+    Returns {channel: number of edited messages}.
+    """
+    updates = await run_sweep(scout_edits, app, channels)
+    payloads = [updates_payload(u, channel) for channel, u in updates.items() if u and u["edited"]]
+    if payloads:
+        print(f"Total edited messages found in this sweep: {sum(len(p['edited']) for p in payloads)}")
+        await asyncio.to_thread(push_updates_batch_to_db, payloads)
+    return {channel: len(u["edited"]) if u else 0 for channel, u in updates.items()}
+
+# --- PUSH INGESTION (update handlers) ---
+
+async def find_unjoined_channels(app, channels=TRACKED_CHANNELS):
+    """
+    Tracked channels the account is not a member of. Telegram pushes updates only for joined
+    channels, so in PUSH mode these still have to be polled. Channels whose membership
+    cannot be checked are returned as well.
+    """
+    unjoined = []
+    for channel in channels:
+        try:
+            await limiter.call(PRIORITY_FETCH, app.get_chat_member, channel, "me")
+        except UserNotParticipant:
+            unjoined.append(channel)
+        except Exception as e:
+            print(f"Could not check membership in {channel}: {e}, it will be polled")
+            unjoined.append(channel)
+    return unjoined
+
+pending_media_groups = {}   # media_group_id -> messages received so far
+flush_tasks = set()         # keep references to running flush tasks
+
+def tracked_channel_for(chat):
+    """
+    Map a Pyrogram chat back to its entry in TRACKED_CHANNELS, so pushed messages
+    are stored and processed under the same channel key as polled ones.
+    """
     for channel in TRACKED_CHANNELS:
-        updates = await scout_edits(channel)
-        if updates:
-            #print(updates["edited"])
-            print(f"Total edited messages found in this loop: {len(updates['edited'])}")
-            result = push_updates_to_db(updates, channel)
-            #print(result)
+        if isinstance(channel, int):
+            if channel == chat.id:
+                return channel
+        elif chat.username and channel.lower() == chat.username.lower():
+            return channel
+    return chat.username or str(chat.id)
+
+async def ingest_pushed_messages(channel, messages, on_ingested=None):
+    """
+    Store a pushed single message or a complete media group, unless the DB already has it
+    (e.g. the catch-up poll got there first). Returns the number of rows inserted.
+    """
+    first_msg = messages[0]
+    mgid = first_msg.media_group_id
+    key = str(mgid) if mgid else str(first_msg.id)
+    db_status = await asyncio.to_thread(fetch_update_status, channel, NUM_MESSAGES + 20)
+    db_keys = {m["message_media_group_id"] or m["message_id"] for m in db_status}
+    if key in db_keys:
+        return 0  # Shortcut only, the insert itself skips rows the DB already has
+
+    messages_by_group = {mgid: messages} if mgid else {}
+    msg_dicts = prepare_messages_for_db(messages, messages_by_group)
+    result = await asyncio.to_thread(push_messages_to_db, msg_dicts)
+    inserted = result.get("inserted", 0) if result else 0
+    if inserted and on_ingested:
+        on_ingested(channel)
+    return inserted
+
+async def flush_media_group(channel, mgid, on_ingested=None):
+    # Album parts arrive as separate updates, wait for the rest before storing the group
+    await asyncio.sleep(MEDIA_GROUP_WAIT)
+    group_msgs = sorted(pending_media_groups.pop(mgid, []), key=lambda m: m.id)
+    if group_msgs:
+        await ingest_pushed_messages(channel, group_msgs, on_ingested)
+
+def register_update_handlers(telegram, on_ingested=None):
+    """
+    Subscribe to new and edited messages of TRACKED_CHANNELS on the shared client.
+    on_ingested(channel) is called after something was written to the DB.
+    """
+    chats = filters.chat(TRACKED_CHANNELS)
+
+    async def on_new_message(client, msg):
+        channel = tracked_channel_for(msg.chat)
+        try:
+            if msg.media_group_id:
+                if msg.media_group_id not in pending_media_groups:
+                    pending_media_groups[msg.media_group_id] = []
+                    task = asyncio.create_task(flush_media_group(channel, msg.media_group_id, on_ingested))
+                    flush_tasks.add(task)
+                    task.add_done_callback(flush_tasks.discard)
+                pending_media_groups[msg.media_group_id].append(msg)
+            else:
+                await ingest_pushed_messages(channel, [msg], on_ingested)
+        except Exception as e:
+            print(f"Error storing pushed message {msg.id} from {channel}: {e}")
+
+    async def on_edited_message(client, msg):
+        channel = tracked_channel_for(msg.chat)
+        if not msg.edit_date:
+            return  # Not a content edit (e.g. reactions or views)
+        update = prepare_update_for_db(msg)
+        if msg.media_group_id and not update["text"]:
+            return  # Media swapped inside an album, its caption lives on another part
+        try:
+            # Skip if the DB already has this edit (e.g. catch-up scouting saw it)
+            db_lookup = normalize_messages(await asyncio.to_thread(fetch_update_status, channel, NUM_MESSAGES_TO_SCOUT))
+            db_msg = db_lookup.get(update["message_media_group_id"] or update["message_id"])
+            if db_msg and update["message_edit_date"] in db_msg["message_edit_date"].split(","):
+                return
+            await asyncio.to_thread(push_updates_to_db, {"unknown": [], "edited": [update]}, channel)
+            if on_ingested:
+                on_ingested(channel)
+        except Exception as e:
+            print(f"Error storing pushed edit {msg.id} from {channel}: {e}")
+
+    telegram.add_handler(MessageHandler(on_new_message, chats))
+    telegram.add_handler(EditedMessageHandler(on_edited_message, chats))
 
 # Load the existing session
 async def main():
-    for channel in TRACKED_CHANNELS:
-        # 0. Fetch messages
-        messages_by_group, single_messages = await fetch_messages(channel)
-
-        if messages_by_group or single_messages:
-            # 1. Combine all messages
-            all_messages = []
-            for group_msgs in messages_by_group.values():
-                all_messages.extend(group_msgs)
-            all_messages.extend(single_messages)
-
-            # 2. Sort by message ID
-            all_messages.sort(key=lambda msg: msg.id)
-            # print(all_messages)
-            if all_messages:
-                first_msg = all_messages[0]
-                mgid = getattr(first_msg, "media_group_id", None)
-
-                if mgid is not None:
-                    # Find all messages with the same media_group_id
-                    group_msgs = [msg for msg in all_messages if getattr(msg, "media_group_id", None) == mgid]
-
-                    # Remove first_msg from all_messages
-                    all_messages = [msg for msg in all_messages if msg not in group_msgs or msg == first_msg]
-
-            # 3. Push to DB
-            msg_dicts = prepare_messages_for_db(all_messages, messages_by_group)
-            for msg in msg_dicts:
-                # print(msg)
-                print(msg.get("message_edit_date"))
-                print(msg.get("text"))
-                result = push_message_to_db(msg)
-                # print(result)
-
-        updates = await scout_edits(channel)
-        if updates:
-            print(updates["edited"])
-            result = push_updates_to_db(updates, channel)
-            print(result)
+    async with Client(SESSION_NAME, API_ID, API_HASH, sleep_threshold=0) as app:
+        await sweep_new_messages(app)
+        await sweep_edits(app)
 
 if __name__ == "__main__":
     if response_data and response_data.get("status") == "ok":
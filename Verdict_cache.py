@@ -0,0 +1,294 @@
+# Verdict_cache.py
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import config
+
+_digits = re.compile(r"\d+")
+_spaces = re.compile(r"\s+")
+_words = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Reduce a formatted message to what matters for its verdict, so re-posts and small edits
+    map to the same key: casefold, drop emoji/symbols and invisible format characters,
+    collapse numbers (dates, prices, counters) and whitespace.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(
+        ch for ch in text
+        if unicodedata.category(ch) not in ("So", "Sk", "Cf", "Cs") and ch != "️"
+    )
+    text = _digits.sub("0", text)
+    return _spaces.sub(" ", text).strip()
+
+
+def model_identity(model_path: str = config.MODEL_PATH) -> str:
+    """Model file name plus size, so replacing the weights invalidates old verdicts."""
+    try:
+        size = os.path.getsize(model_path)
+    except OSError:
+        size = 0
+    return f"{os.path.basename(model_path)}:{size}"
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of the normalized text over word pairs (single words for one-word texts)."""
+    tokens = _words.findall(normalize_text(text))
+    features = [tokens[i] + " " + tokens[i + 1] for i in range(len(tokens) - 1)] or tokens
+    weights = [0] * 64
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def _to_signed(value):
+    # SQLite INTEGER is signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class NearDuplicateIndex:
+    """
+    Bounded SimHash index of confidently scored messages.
+
+    The 64-bit hash is split into bands; two hashes within max_distance bits of each other always share
+    at least one band exactly when max_distance < bands, so a lookup only compares against the few
+    entries in matching band buckets. Entries live in memory (LRU, max_entries) and are mirrored into
+    the verdict cache database, so the index survives restarts. Like exact verdicts they expire after ttl seconds.
+    """
+
+    def __init__(self, conn, context, ttl=config.VERDICT_CACHE_TTL, max_distance=config.NEAR_DUP_MAX_DISTANCE,
+                 max_entries=config.NEAR_DUP_MAX_ENTRIES, bands=config.NEAR_DUP_BANDS,
+                 min_tokens=config.NEAR_DUP_MIN_TOKENS):
+        self.conn = conn
+        self.context = context
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.bands = bands
+        self.band_bits = 64 // bands
+        self.min_tokens = min_tokens
+        self.entries = OrderedDict()        # simhash -> (score, created_at), oldest first
+        self.buckets = {}                   # (band, band value) -> set of simhashes
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS near_duplicates (
+                context TEXT,
+                simhash INTEGER,
+                score INTEGER,
+                last_used REAL,
+                created_at REAL,
+                PRIMARY KEY (context, simhash)
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(near_duplicates)")]
+        if "created_at" not in columns:
+            # Tables from before near entries expired, their rows have no created_at and count as expired
+            self.conn.execute("ALTER TABLE near_duplicates ADD COLUMN created_at REAL")
+        if self.ttl:
+            self.conn.execute("DELETE FROM near_duplicates WHERE context = ? AND (created_at IS NULL OR created_at < ?)",
+                              (context, time.time() - self.ttl))
+        rows = self.conn.execute("""
+            SELECT simhash, score, created_at FROM near_duplicates WHERE context = ?
+            ORDER BY last_used DESC LIMIT ?
+        """, (context, max_entries)).fetchall()
+        for h, score, created_at in reversed(rows):
+            self._insert(h % (1 << 64), score, created_at or 0.0)
+
+    def _band_keys(self, h):
+        mask = (1 << self.band_bits) - 1
+        return [(band, (h >> (band * self.band_bits)) & mask) for band in range(self.bands)]
+
+    def _insert(self, h, score, created_at):
+        if h in self.entries:
+            self.entries.move_to_end(h)
+        else:
+            for key in self._band_keys(h):
+                self.buckets.setdefault(key, set()).add(h)
+        self.entries[h] = (score, created_at)
+        evicted = []
+        while len(self.entries) > self.max_entries:
+            old = next(iter(self.entries))
+            self._remove(old)
+            evicted.append(old)
+        return evicted
+
+    def _remove(self, h):
+        del self.entries[h]
+        for key in self._band_keys(h):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(h)
+                if not bucket:
+                    del self.buckets[key]
+
+    def signature(self, text):
+        """SimHash of text, or None when it is too short for a meaningful comparison."""
+        if len(_words.findall(text)) < self.min_tokens:
+            return None
+        return simhash(text)
+
+    def find(self, h):
+        """Score of the closest unexpired entry within max_distance bits of h, or None."""
+        now = time.time()
+        best = None
+        expired = set()
+        for key in self._band_keys(h):
+            for candidate in self.buckets.get(key, ()):
+                distance = bin(candidate ^ h).count("1")
+                if distance > self.max_distance or (best is not None and distance >= best[0]):
+                    continue
+                if self.ttl and now - self.entries[candidate][1] > self.ttl:
+                    expired.add(candidate)
+                    continue
+                best = (distance, candidate)
+        if expired:
+            for old in expired:
+                self._remove(old)
+            self.conn.executemany("DELETE FROM near_duplicates WHERE context = ? AND simhash = ?",
+                                  [(self.context, _to_signed(old)) for old in expired])
+        if best is None:
+            return None
+        self.entries.move_to_end(best[1])
+        self.conn.execute("UPDATE near_duplicates SET last_used = ? WHERE context = ? AND simhash = ?",
+                          (now, self.context, _to_signed(best[1])))
+        return self.entries[best[1]][0]
+
+    def add(self, h, score):
+        now = time.time()
+        evicted = self._insert(h, score, now)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO near_duplicates (context, simhash, score, last_used, created_at) VALUES (?, ?, ?, ?, ?)",
+            (self.context, _to_signed(h), int(score), now, now)
+        )
+        if evicted:
+            self.conn.executemany("DELETE FROM near_duplicates WHERE context = ? AND simhash = ?",
+                                  [(self.context, _to_signed(old)) for old in evicted])
+
+
+class VerdictCache:
+    """
+    Persistent cache of LLM scores keyed by sha256(normalized text, prompt template, model identity).
+
+    Stored in its own SQLite file next to messages.db. Entries expire after ttl seconds, and when
+    the cache grows past max_entries the least recently used ones are evicted. Safe to use from
+    several threads (the scoring stage runs in worker threads).
+
+    When no exact entry exists, lookup() also checks a NearDuplicateIndex of confidently scored
+    messages, so templated posts with a different link, price or emoji reuse the earlier verdict.
+    """
+
+    def __init__(self, path=config.VERDICT_CACHE_PATH, ttl=config.VERDICT_CACHE_TTL,
+                 max_entries=config.VERDICT_CACHE_MAX_ENTRIES, template=config.prompt_template, model_id=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.context = hashlib.sha256(
+            (template + "\0" + config.Scoring_parameter + "\0" + (model_id or model_identity())).encode("utf-8")
+        ).hexdigest()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                key TEXT PRIMARY KEY,
+                score INTEGER,
+                created_at REAL,
+                last_used REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_last_used ON verdicts (last_used)")
+        self.similar = NearDuplicateIndex(self._conn, self.context, ttl) if config.NEAR_DUP_DETECTION else None
+        self._conn.commit()
+
+    def key(self, formatted_text: str) -> str:
+        return hashlib.sha256((self.context + "\0" + normalize_text(formatted_text)).encode("utf-8")).hexdigest()
+
+    def _get(self, key, now):
+        row = self._conn.execute("SELECT score, created_at FROM verdicts WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl and now - row[1] > self.ttl):
+            return None
+        with self._conn:
+            self._conn.execute("UPDATE verdicts SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def get(self, key: str):
+        with self._lock:
+            score = self._get(key, time.time())
+            if score is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return score
+
+    def lookup(self, formatted_text: str):
+        """
+        Return (key, score) for a formatted message text, score is None on a miss.
+        Tries the exact key first, then near duplicates.
+        """
+        key = self.key(formatted_text)
+        h = self.similar.signature(formatted_text) if self.similar is not None else None
+        with self._lock:
+            score = self._get(key, time.time())
+            if score is not None:
+                self.hits += 1
+                return key, score
+            if h is not None:
+                with self._conn:
+                    score = self.similar.find(h)
+            if score is None:
+                self.misses += 1
+            else:
+                self.near_hits += 1
+        return key, score
+
+    def put(self, key: str, score: int, formatted_text: str = None):
+        now = time.time()
+        h = None
+        if formatted_text is not None and self.similar is not None and \
+                abs(int(score) - config.Scoring_messaging_gap) >= config.NEAR_DUP_MIN_MARGIN:
+            h = self.similar.signature(formatted_text)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts (key, score, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, int(score), now, now)
+            )
+            self._evict(now)
+            if h is not None:
+                self.similar.add(h, score)
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM verdicts WHERE created_at < ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        if count > self.max_entries:
+            # Drop down to 90% at once, so eviction does not run on every insert
+            self._conn.execute("""
+                DELETE FROM verdicts WHERE key IN (
+                    SELECT key FROM verdicts ORDER BY last_used ASC LIMIT ?
+                )
+            """, (count - int(self.max_entries * 0.9),))
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+            near_entries = len(self.similar.entries) if self.similar is not None else 0
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": entries,
+            "near_entries": near_entries,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,109 @@
+# benchmarks/db_indexes_benchmark.py
+# Query time of the hot DB endpoints on a large messages.db, before and after run_migrations().
+# Usage (from the repository root): python benchmarks/db_indexes_benchmark.py [rows]
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SQLite_database import create_base_tables, run_migrations
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+CHANNELS = 50
+USER_ID = 1433345
+REPEAT = 20
+
+QUERIES = {
+    "processing": ("""
+        SELECT message_id, user_id, channel_id, messages_entities, text, status, is_protected
+        FROM messages
+        WHERE user_id = ? AND channel_id = ?
+          AND status IN ('new', 'edited')
+        ORDER BY id ASC
+        LIMIT ?
+    """, lambda ch, mid: (USER_ID, ch, 10)),
+    "update_status": ("""
+        SELECT message_id, message_media_group_id, message_date, message_edit_date
+        FROM messages
+        WHERE user_id=? AND channel_id=?
+        ORDER BY message_date DESC
+        LIMIT ?
+    """, lambda ch, mid: (USER_ID, ch, 120)),
+    "apply_updates": ("""
+        SELECT id FROM messages
+        WHERE (channel_id = ? AND message_media_group_id IS NOT NULL AND message_media_group_id = ?)
+           OR (channel_id = ? AND message_media_group_id IS NULL AND message_id = ?)
+    """, lambda ch, mid: (ch, None, ch, str(mid))),
+    "tracking_check": ("""
+        SELECT target_channel_id, target_message_id FROM message_links
+        WHERE user_id = ? AND channel_id = ? AND message_id = ?
+    """, lambda ch, mid: (USER_ID, ch, str(mid))),
+}
+
+
+def fill(conn):
+    rnd = random.Random(42)
+    per_channel = ROWS // CHANNELS
+    rows = []
+    links = []
+    for n in range(ROWS):
+        ch = f"channel{n % CHANNELS}"
+        mid = n // CHANNELS + 1
+        # Almost everything is already processed, a small tail is pending
+        status = "new" if mid > per_channel - 5 else rnd.choice(("filtered", "filtered", "filtered", "edited")) if mid > per_channel - 20 else "filtered"
+        mgid = str(10**12 + n // 4) if n % 10 == 0 else None
+        date = f"2025-01-01 00:00:00+{mid:08d}"
+        rows.append((str(mid), mgid, USER_ID, ch, None, date, None, None, None, None, None, "x" * 200, status, False))
+        if status == "filtered" and n % 2 == 0:
+            links.append((USER_ID, ch, str(mid), "-100200300", str(n)))
+    conn.executemany("""
+        INSERT INTO messages (
+            message_id, message_media_group_id, user_id, channel_id, message_media, message_date,
+            message_edit_date, message_forward_from, message_forward_from_chat,
+            message_reply_to_message_id, messages_entities, text, status, is_protected
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.executemany("""
+        INSERT INTO message_links (user_id, channel_id, message_id, target_channel_id, target_message_id)
+        VALUES (?, ?, ?, ?, ?)
+    """, links)
+    conn.commit()
+
+
+def measure(conn):
+    rnd = random.Random(7)
+    per_channel = ROWS // CHANNELS
+    result = {}
+    for name, (sql, params) in QUERIES.items():
+        args = [params(f"channel{rnd.randrange(CHANNELS)}", rnd.randrange(1, per_channel)) for _ in range(REPEAT)]
+        started = time.perf_counter()
+        for a in args:
+            conn.execute(sql, a).fetchall()
+        result[name] = (time.perf_counter() - started) / REPEAT * 1000
+    return result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "messages.db"))
+        create_base_tables(conn)
+        print(f"Filling {ROWS} messages...")
+        fill(conn)
+
+        before = measure(conn)
+        started = time.perf_counter()
+        run_migrations(conn)
+        print(f"Migrations took {time.perf_counter() - started:.1f}s")
+        after = measure(conn)
+        conn.close()
+
+    print(f"{'query':<16}{'before, ms':>12}{'after, ms':>12}{'speedup':>10}")
+    for name in QUERIES:
+        print(f"{name:<16}{before[name]:>12.3f}{after[name]:>12.3f}{before[name] / after[name]:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/entities_benchmark.py
+# Time of apply_entities_to_text on long posts with many entities, against the previous implementation
+# (per-character UTF-16 prefix list, one string rebuild per entity), which is kept below for comparison.
+# Usage (from the repository root): python benchmarks/entities_benchmark.py [text_length] [entities]
+import os
+import sys
+import time
+import bisect
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Telegram_AI_processor import apply_entities_to_text, _parse_entities, _escape_for_markdown
+
+TEXT_LENGTH = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+ENTITIES = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+REPEAT = 200
+TYPES = ("BOLD", "ITALIC", "STRIKETHROUGH", "CODE", "TEXT_LINK", "MENTION")
+
+
+def previous_apply_entities_to_text(text, entities_raw):
+    entities = _parse_entities(entities_raw)
+    if not entities:
+        return text
+    prefix = [0]
+    for ch in text:
+        prefix.append(prefix[-1] + len(ch.encode('utf-16-le')) // 2)
+
+    def to_py(utf16_index):
+        if utf16_index <= 0:
+            return 0
+        if utf16_index >= prefix[-1]:
+            return len(prefix) - 1
+        return bisect.bisect_left(prefix, utf16_index)
+
+    normalized = []
+    for e in entities:
+        offset, length = int(e.get("offset", 0)), int(e.get("length", 0))
+        normalized.append((to_py(offset), to_py(offset + length), str(e.get("type", "")).split(".")[-1].upper(), e.get("url")))
+    normalized.sort(key=lambda x: x[0], reverse=True)
+    for s, e, t, url in normalized:
+        if s >= len(text):
+            continue
+        e = min(max(e, s), len(text))
+        substring = text[s:e]
+        if t == "BOLD":
+            repl = f"**{substring}**"
+        elif t == "STRIKETHROUGH":
+            repl = f"~~{substring}~~"
+        elif t == "ITALIC":
+            repl = f"__{substring}__"
+        elif t in ("TEXT_LINK", "URL", "TEXTURL") and url:
+            repl = f"[{_escape_for_markdown(substring)}]({url})"
+        elif t == "CODE":
+            repl = f"`{substring}`"
+        elif t == "PRE":
+            repl = f"```{substring}```"
+        else:
+            repl = substring
+        text = text[:s] + repl + text[e:]
+    return text
+
+
+def make_post(rnd):
+    """Text with some emoji (two UTF-16 units each) and non-overlapping entities in Telegram offsets."""
+    words = ["sale", "новости", "канал", "link", "price", "😀", "🔥", "(info)", "[1]", "\n"]
+    text = ""
+    while len(text) < TEXT_LENGTH:
+        text += rnd.choice(words) + " "
+    step = max(2, len(text) // ENTITIES)
+    entities = []
+    for start in range(0, len(text) - step, step):
+        end = start + rnd.randrange(1, step)
+        offset = len(text[:start].encode("utf-16-le")) // 2
+        kind = rnd.choice(TYPES)
+        entities.append({"offset": offset, "length": len(text[start:end].encode("utf-16-le")) // 2,
+                         "type": f"MessageEntityType.{kind}",
+                         "url": "https://example.com" if kind == "TEXT_LINK" else None})
+    return text, entities
+
+
+def measure(fn, posts):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        for text, entities in posts:
+            fn(text, entities)
+    return (time.perf_counter() - started) / (REPEAT * len(posts)) * 1_000_000
+
+
+def main():
+    rnd = random.Random(42)
+    posts = [make_post(rnd) for _ in range(5)]
+    for text, entities in posts:
+        # Same output where the previous implementation was correct (no nesting)
+        assert apply_entities_to_text(text, entities) == previous_apply_entities_to_text(text, entities)
+
+    before = measure(previous_apply_entities_to_text, posts)
+    after = measure(apply_entities_to_text, posts)
+    print(f"{len(posts[0][0])} chars, {len(posts[0][1])} entities per post")
+    print(f"{'previous, us':>14}{'current, us':>14}{'speedup':>10}")
+    print(f"{before:>14.1f}{after:>14.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,32 @@
 database_ipaddress = "127.0.0.1"
 database_port = "8000"
 
+# SQLite settings of the database server (SQLite_database.py)
+# Example: DB_PATH = "messages.db"
+DB_PATH = "messages.db"
+# Page cache per connection in KiB
+# Example: DB_CACHE_SIZE_KB = 65536
+DB_CACHE_SIZE_KB = 65536
+# Bytes of the DB file to memory-map, 0 to disable
+# Example: DB_MMAP_SIZE = 268435456
+DB_MMAP_SIZE = 268435456
+# Threads serving read endpoints, writes always go through one dedicated writer thread
+# Example: DB_READ_THREADS = 4
+DB_READ_THREADS = 4
+# Prepared statements kept per connection
+# Example: DB_STATEMENT_CACHE_SIZE = 256
+DB_STATEMENT_CACHE_SIZE = 256
+# Workers claim pending messages with a lease, a message not acked within LEASE_SECONDS can be claimed again
+# Keep it above LLM_REQUEST_TIMEOUT, the lease is renewed for publishing once the messages are scored
+# Example: LEASE_SECONDS = 900
+LEASE_SECONDS = 900
+# Claims without an ack before a message gets status "failed"
+# Example: LEASE_MAX_ATTEMPTS = 5
+LEASE_MAX_ATTEMPTS = 5
+# Seconds before a message whose scoring or publishing failed is retried
+# Example: LEASE_RETRY_DELAY = 30
+LEASE_RETRY_DELAY = 30
+
 # LLM Configurations
 llm_ipaddress = "127.0.0.1"
 llm_port = "5000"
@@ -14,7 +40,7 @@ MODEL_PATH = "models/mistral-7b-instruct-v0.2.Q4_K_M.gguf"
 #Config for LLM inside of LLM_Suitcase_server.py
 LLM_CONFIG = {
     "model_path": MODEL_PATH,
-    "n_ctx": 16384,
+    "n_ctx": 4096,  # long posts are cut to fit (head, tail and links are kept)
     "n_threads": 1,
     "backend": "cuda",
     "n_gpu_layers": -1,
@@ -36,6 +62,34 @@ LLM_CONFIG = {
     "verbose": False,
 }
 
+# Amount of evaluated prompt prefixes (KV cache states) the LLM server keeps, the static head of prompt_template is always registered at startup.
+# Every entry holds a copy of the KV cache for its prefix.
+# Example: PREFIX_CACHE_SIZE = 4
+PREFIX_CACHE_SIZE = 4
+# Amount of model processes. With more than 1 the launcher starts LLM_WORKERS copies of the LLM server on ports
+# LLM_WORKER_BASE_PORT, LLM_WORKER_BASE_PORT + 1, ..., each pinned to its own share of CPU cores with n_threads set
+# to the number of its cores, and a dispatcher on llm_port sending requests to the least-loaded worker.
+# Meant for CPU inference, on a GPU every worker would hold its own copy of the model in video memory.
+# Example: LLM_WORKERS = 4
+LLM_WORKERS = 1
+# Example: LLM_WORKER_BASE_PORT = 5001
+LLM_WORKER_BASE_PORT = 5001
+# Cores of every worker, None to split the available cores evenly
+# Example: LLM_WORKER_CORES = [[0, 1, 2, 3], [4, 5, 6, 7]]
+LLM_WORKER_CORES = None
+# Requests wait in a priority queue in front of the model (per worker), when it is full the server answers 429
+# Example: LLM_QUEUE_SIZE = 32
+LLM_QUEUE_SIZE = 32
+# Seconds a request may wait and run before the server gives up on it with 504
+# Example: LLM_REQUEST_TIMEOUT = 600
+LLM_REQUEST_TIMEOUT = 600
+# Messages posted less than LLM_FRESH_AGE seconds ago are scored with LLM_PRIORITY_FRESH, older backlog
+# with LLM_PRIORITY_BACKFILL (lower runs first)
+# Example: LLM_FRESH_AGE = 900
+LLM_FRESH_AGE = 900
+LLM_PRIORITY_FRESH = 0
+LLM_PRIORITY_BACKFILL = 10
+
 # Telegram Bot Credentials and Channel Details
 # integer example API_ID = 0000000
 API_ID = 0000000
@@ -70,11 +124,94 @@ NUM_MESSAGES_TO_SCOUT = 100
 # Example: NUM_MESSAGES_TO_SCOUT = 3600
 INTERVAL_FOR_SCOUT = 3600
 
+# How new messages and edits get into the DB
+# "PUSH" subscribes to Telegram updates of TRACKED_CHANNELS and stores them as they arrive,
+# polling (NUM_MESSAGES/NUM_MESSAGES_TO_SCOUT) then only runs as catch-up after every (re)connect and every INTERVAL_TO_CATCH_UP.
+# Telegram pushes updates only for channels the account has joined, tracked channels it is not a member of
+# keep being polled every INTERVAL_TO_GATHER/INTERVAL_FOR_SCOUT.
+# "POLL" only polls every INTERVAL_TO_GATHER/INTERVAL_FOR_SCOUT seconds.
+INGEST_MODE = "PUSH"  # "PUSH", "POLL"
+# Example: INTERVAL_TO_CATCH_UP = 3600, 0 to catch up only after reconnects
+INTERVAL_TO_CATCH_UP = 3600
+# Seconds to wait for the rest of an album after its first part arrived
+# Example: MEDIA_GROUP_WAIT = 1.5
+MEDIA_GROUP_WAIT = 1.5
+# Parts of an album downloaded at the same time when reloading
+# Example: MEDIA_DOWNLOAD_CONCURRENCY = 4
+MEDIA_DOWNLOAD_CONCURRENCY = 4
+# Files up to this size (bytes) are downloaded into memory and uploaded from there, bigger ones go through media/
+# Example: MEDIA_IN_MEMORY_MAX_SIZE = 20 * 1024 * 1024
+MEDIA_IN_MEMORY_MAX_SIZE = 20 * 1024 * 1024
+# Reloaded media is kept in a store keyed by Telegram file_unique_id, so a file cross-posted by several channels
+# is downloaded once, and the file_id of our upload is reused to re-send it without uploading again
+# Example: MEDIA_CACHE = True
+MEDIA_CACHE = True
+# Example: MEDIA_CACHE_DIR = "media/store"
+MEDIA_CACHE_DIR = "media/store"
+# Example: MEDIA_CACHE_INDEX_PATH = "media_cache.db"
+MEDIA_CACHE_INDEX_PATH = "media_cache.db"
+# Least recently used files are deleted when the store grows past this many bytes
+# Example: MEDIA_CACHE_MAX_BYTES = 2 * 1024 ** 3
+MEDIA_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Channels fetched at the same time during a polling/catch-up sweep, keep it low to stay clear of Telegram flood limits
+# Example: INGEST_PARALLEL_CHANNELS = 4
+INGEST_PARALLEL_CHANNELS = 4
+
+# Telegram rate limiter (Telegram_limiter.py), shared by every Telegram call of the process
+# Calls per second to start with, raised by TELEGRAM_RATE_STEP after every successful call up to TELEGRAM_RATE_MAX
+# Example: TELEGRAM_RATE = 2.0
+TELEGRAM_RATE = 2.0
+# Example: TELEGRAM_RATE_MAX = 5.0
+TELEGRAM_RATE_MAX = 5.0
+# Every FloodWait halves the rate, but never below this
+# Example: TELEGRAM_RATE_MIN = 0.2
+TELEGRAM_RATE_MIN = 0.2
+# Example: TELEGRAM_RATE_STEP = 0.05
+TELEGRAM_RATE_STEP = 0.05
+# Calls allowed back to back after an idle period
+# Example: TELEGRAM_BURST = 5
+TELEGRAM_BURST = 5
+# How many times a call is retried after waiting out a FloodWait before the error is raised
+# Example: TELEGRAM_FLOOD_RETRIES = 3
+TELEGRAM_FLOOD_RETRIES = 3
+
+# Pipeline scheduler (TG_Sentinel_lanucher.py): ingest -> scoring -> publishing
+# Amount of workers per stage, each stage runs independently of the others
+# Example: SCORING_CONCURRENCY = 1
+INGEST_CONCURRENCY = 1
+SCORING_CONCURRENCY = 1
+PUBLISHING_CONCURRENCY = 1
+# Max amount of pending messages of one channel scored in a single LLM batch request,
+# channels with a bigger backlog take turns (round-robin) batch by batch until drained
+# Example: SCORING_BATCH_SIZE = 8
+SCORING_BATCH_SIZE = 8
+# Max amount of items waiting in a stage queue, when it is full the previous stage waits (backpressure)
+# Example: PUBLISHING_QUEUE_SIZE = 10
+SCORING_QUEUE_SIZE = 100
+PUBLISHING_QUEUE_SIZE = 10
+# How often (seconds) to look for messages left unprocessed in the DB, e.g. after a restart
+# Example: PIPELINE_POLL_INTERVAL = 5
+PIPELINE_POLL_INTERVAL = 5
+# How often (seconds) to print queue depth and stage latency, 0 to disable
+# Example: PIPELINE_STATS_INTERVAL = 60
+PIPELINE_STATS_INTERVAL = 60
+
 # Transfer Methods Configuration
 TRANSFERING_METHOD = "SMART"  # "FORWARDING", "RELOADING", "SMART"
 # "FORWARDING" for forwarding
 # "RELOADING" for downloading and posting
 # "SMART" for forwarding when message is not protected, but downloading and posting when original message protected
+# Approved messages of a source channel that are forwarded within this many seconds go out in one
+# forward_messages call, 0 forwards every message on its own
+# Example: FORWARD_BATCH_WINDOW = 1.0
+FORWARD_BATCH_WINDOW = 1.0
+# Telegram forwards at most 100 messages per call
+# Example: FORWARD_BATCH_MAX_IDS = 100
+FORWARD_BATCH_MAX_IDS = 100
+# Times a failed DB ack of forwarded messages is retried (after 1, 2, 4, ... seconds, renewing their leases)
+# before it is left for the next flush of the channel
+# Example: FORWARD_ACK_RETRIES = 5
+FORWARD_ACK_RETRIES = 5
 
 #Setting to remove custom emoji from entities if you do not have premium. True is to remove, False to keep.
 #Example: REMOVE_CUSTOM_EMOJI = True
@@ -87,6 +224,59 @@ Scoring_parameter = "AD_Score"
 # This number is used to filter messages, if your AI provide this number or higher in output, the message would be filtered
 # Example: Scoring_messaging_gap = 75
 Scoring_messaging_gap = 75
+# The LLM server stops generating as soon as [{Scoring_parameter}: X] is produced.
+# Set LLM_SCORE_GRAMMAR = True to also force the output into one short reasoning line followed by that tag (GBNF grammar).
+# Example: LLM_SCORE_GRAMMAR = False
+LLM_SCORE_GRAMMAR = False
+# Max length of the reasoning line when LLM_SCORE_GRAMMAR is on
+# Example: SCORE_REASONING_MAX_CHARS = 300
+SCORE_REASONING_MAX_CHARS = 300
+# Scores are cached by the normalized text of the message, the prompt template and the model, so re-posts and
+# cross-posts are not sent to the LLM again. The cache is a separate SQLite file next to DB_PATH.
+# Example: VERDICT_CACHE = True
+VERDICT_CACHE = True
+# Example: VERDICT_CACHE_PATH = "verdict_cache.db"
+VERDICT_CACHE_PATH = "verdict_cache.db"
+# Entries older than this many seconds are not used, 0 to keep them until evicted
+# Example: VERDICT_CACHE_TTL = 604800
+VERDICT_CACHE_TTL = 604800
+# Least recently used entries are evicted above this size
+# Example: VERDICT_CACHE_MAX_ENTRIES = 100000
+VERDICT_CACHE_MAX_ENTRIES = 100000
+# Near-duplicates: a message whose SimHash is within NEAR_DUP_MAX_DISTANCE bits (of 64) of a confidently
+# scored one inherits its score without an LLM call. Confident means at least NEAR_DUP_MIN_MARGIN away from Scoring_messaging_gap.
+# Example: NEAR_DUP_DETECTION = True
+NEAR_DUP_DETECTION = True
+# Example: NEAR_DUP_MAX_DISTANCE = 6
+NEAR_DUP_MAX_DISTANCE = 6
+# Number of bands the hash is split into for lookup, must be bigger than NEAR_DUP_MAX_DISTANCE
+# Example: NEAR_DUP_BANDS = 8
+NEAR_DUP_BANDS = 8
+# Example: NEAR_DUP_MIN_MARGIN = 20
+NEAR_DUP_MIN_MARGIN = 20
+# Shorter messages are too similar to each other to compare this way
+# Example: NEAR_DUP_MIN_TOKENS = 8
+NEAR_DUP_MIN_TOKENS = 8
+# Example: NEAR_DUP_MAX_ENTRIES = 50000
+NEAR_DUP_MAX_ENTRIES = 50000
+# Pre-filter: a cheap classifier over links, entities and keywords that runs before the cache and the LLM.
+# It decides "definitely clean" (score 0) and "definitely ad" (score 100), everything else goes to the LLM.
+# Its thresholds are calibrated on past LLM verdicts: run python Prefilter_calibration.py with the DB server up.
+# Until a calibration file exists every message goes to the LLM. None to disable.
+# Example: PREFILTER = "LINEAR"
+PREFILTER = "LINEAR"
+# Example: PREFILTER_CALIBRATION_PATH = "prefilter_calibration.json"
+PREFILTER_CALIBRATION_PATH = "prefilter_calibration.json"
+# Largest share of pre-filter decisions allowed to disagree with the LLM on held-out messages
+# Example: PREFILTER_MAX_ERROR = 0.02
+PREFILTER_MAX_ERROR = 0.02
+# Example: PREFILTER_MIN_SAMPLES = 200
+PREFILTER_MIN_SAMPLES = 200
+# Example: PREFILTER_CALIBRATION_LIMIT = 20000
+PREFILTER_CALIBRATION_LIMIT = 20000
+# Example: PREFILTER_AD_KEYWORDS = ["promo code", "discount", "giveaway"]
+PREFILTER_AD_KEYWORDS = ["promo code", "promocode", "discount", "giveaway", "sale", "subscribe", "sponsor", "partner",
+                         "промокод", "скидк", "розыгрыш", "подпис", "реклам", "партнер"]
 # Prompt Template for the AI
 # The mechanism used to parse text include {Scoring_parameter}, {text} and {channel_id}, those provide text from scoring_messaging_gap parameter from above, text from telegram message and id/name of channel for this message accordingly.
 # It is of high importance to note, that filtering tool seek [{Scoring_parameter}: X] structure, where X is integer value, by this i recommend to design prompt in a way AI would always provide this structure and use it to inform program about their conclusion.
@@ -0,0 +1,52 @@
+# tests/test_entities.py
+# Telegram entity offsets (UTF-16 code units) mapped onto Python strings.
+from Telegram_AI_processor import _utf16_to_py_mapper, apply_entities_to_text
+
+
+def utf16_offset(text, index):
+    return len(text[:index].encode("utf-16-le")) // 2
+
+
+def test_mapper_matches_utf16_lengths():
+    text = "a😀bц🔥🔥 d"
+    to_py = _utf16_to_py_mapper(text)
+    for index in range(len(text) + 1):
+        assert to_py(utf16_offset(text, index)) == index
+
+
+def test_mapper_inside_surrogate_pair_and_out_of_range():
+    text = "😀x"
+    to_py = _utf16_to_py_mapper(text)
+    assert to_py(1) == 1        # Between the two units of the emoji
+    assert to_py(-5) == 0
+    assert to_py(100) == len(text)
+
+
+def test_mapper_without_astral_characters():
+    to_py = _utf16_to_py_mapper("plain текст")
+    assert [to_py(i) for i in range(4)] == [0, 1, 2, 3]
+
+
+def entity(text, start, end, kind, url=None):
+    offset = utf16_offset(text, start)
+    return {"offset": offset, "length": utf16_offset(text, end) - offset, "type": f"MessageEntityType.{kind}", "url": url}
+
+
+def test_entities_after_emoji():
+    text = "🔥🔥 Sale now"
+    entities = [entity(text, 3, 7, "BOLD"), entity(text, 8, 11, "TEXT_LINK", "https://example.com")]
+    assert apply_entities_to_text(text, entities) == "🔥🔥 **Sale** [now](https://example.com)"
+
+
+def test_nested_and_crossing_entities_pair_up():
+    text = "one two three"
+    nested = [entity(text, 0, 13, "BOLD"), entity(text, 4, 7, "ITALIC")]
+    assert apply_entities_to_text(text, nested) == "**one __two__ three**"
+    crossing = [entity(text, 0, 7, "BOLD"), entity(text, 4, 13, "ITALIC")]
+    assert apply_entities_to_text(text, crossing) == "**one __two__**__ three__"
+
+
+def test_entities_as_json_string():
+    text = "😀 hi"
+    raw = '[{"offset": 3, "length": 2, "type": "MessageEntityType.CODE"}]'
+    assert apply_entities_to_text(text, raw) == "😀 `hi`"
@@ -0,0 +1,121 @@
+# tests/test_leases.py
+# Claim, renew, release and ack of pending messages, and storing each source message once, on a temporary DB.
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+import SQLite_database
+
+USER_ID = 1
+CHANNEL = "channel"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLite_database, "DB_PATH", str(tmp_path / "messages.db"))
+    with TestClient(SQLite_database.tg_database) as client:
+        yield client
+
+
+def message(message_id, **fields):
+    return {"message_id": str(message_id), "user_id": USER_ID, "channel_id": CHANNEL,
+            "text": f"post {message_id}", "status": "new", **fields}
+
+
+def claim(client, owner, limit=10, lease_seconds=60):
+    response = client.post(f"/claim/{USER_ID}/{CHANNEL}",
+                           json={"owner": owner, "limit": limit, "lease_seconds": lease_seconds})
+    return [m["message_id"] for m in response.json()["messages"]]
+
+
+def filtering(client, owner, message_id):
+    return client.post(f"/filtering/{USER_ID}/{CHANNEL}", json={"message_id": message_id, "owner": owner}).json()
+
+
+def test_claimed_messages_are_hidden_from_other_workers(client):
+    client.post("/messages/batch", json=[message(i) for i in (1, 2, 3)])
+    assert claim(client, "a", limit=2) == ["1", "2"]
+    assert claim(client, "b") == ["3"]
+    assert claim(client, "c") == []
+
+
+def test_expired_lease_can_be_claimed_again(client):
+    client.post("/messages/batch", json=[message(1)])
+    assert claim(client, "a", lease_seconds=0) == ["1"]
+    assert claim(client, "b") == ["1"]
+    # The first worker lost the message, its ack is refused
+    assert filtering(client, "a", "1")["status"] == "error"
+    assert filtering(client, "b", "1")["status"] == "ok"
+
+
+def test_renew_only_extends_own_leases(client):
+    client.post("/messages/batch", json=[message(1)])
+    claim(client, "a")
+    renew = {"message_ids": ["1"], "lease_seconds": 60}
+    assert client.post(f"/renew/{USER_ID}/{CHANNEL}", json={"owner": "b", **renew}).json()["renewed"] == 0
+    assert client.post(f"/renew/{USER_ID}/{CHANNEL}", json={"owner": "a", **renew}).json()["renewed"] == 1
+
+
+def test_release_makes_messages_claimable_after_retry_delay(client):
+    client.post("/messages/batch", json=[message(1), message(2)])
+    claim(client, "a")
+    released = client.post(f"/release/{USER_ID}/{CHANNEL}",
+                           json={"owner": "a", "message_ids": ["1"], "retry_after": 0}).json()
+    assert released["released"] == 1
+    assert claim(client, "b") == ["1"]
+    client.post(f"/release/{USER_ID}/{CHANNEL}", json={"owner": "b", "message_ids": ["1"], "retry_after": 60})
+    assert claim(client, "c") == []
+
+
+def test_failed_after_max_attempts(client, monkeypatch):
+    monkeypatch.setattr(SQLite_database.config, "LEASE_MAX_ATTEMPTS", 2)
+    client.post("/messages/batch", json=[message(1)])
+    assert claim(client, "a", lease_seconds=0) == ["1"]
+    assert claim(client, "a", lease_seconds=0) == ["1"]
+    assert claim(client, "a") == []
+    messages = client.get(f"/messages/{USER_ID}/{CHANNEL}").json()["messages"]
+    assert messages[0]["status"] == "failed"
+
+
+def test_published_acks_and_tracks_only_own_leases(client):
+    client.post("/messages/batch", json=[message(1), message(2)])
+    claim(client, "a", limit=1)
+    claim(client, "b", limit=1)
+    records = [{"message_id": str(i), "target_channel_id": "target", "target_message_id": str(100 + i)} for i in (1, 2)]
+    result = client.post(f"/published/{USER_ID}/{CHANNEL}", json={"owner": "a", "records": records}).json()
+    assert result["filtered"] == ["1"]
+    assert result["tracked"] == 1
+    check = client.post(f"/tracking_check/{USER_ID}/{CHANNEL}", json={"message_id": "2"}).json()
+    assert check["status"] == "not_found"
+
+
+def test_edit_clears_the_lease(client):
+    client.post("/messages/batch", json=[message(1)])
+    claim(client, "a")
+    edit = {"message_id": "1", "message_date": "2026-01-01 00:00:00",
+            "message_edit_date": "2026-01-01 00:05:00", "text": "edited"}
+    client.post("/apply_updates/", json={"user_id": str(USER_ID), "channel_id": CHANNEL, "edited": [edit]})
+    # The worker holding the old version cannot ack the edit, it is claimable right away
+    assert filtering(client, "a", "1")["status"] == "error"
+    assert claim(client, "b") == ["1"]
+
+
+def test_duplicate_inserts_are_ignored(client):
+    first = client.post("/messages/batch", json=[message(1), message(2)]).json()
+    # A pushed copy and a catch-up sweep storing the same post
+    second = client.post("/messages/batch", json=[message(2), message(3)]).json()
+    single = client.post("/messages/", json=message(3)).json()
+    assert (first["inserted"], second["inserted"], single["inserted"]) == (2, 1, 0)
+    assert claim(client, "a") == ["1", "2", "3"]
+
+
+def test_migration_removes_existing_duplicates(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    SQLite_database.create_base_tables(conn)
+    for _ in range(2):
+        conn.execute("INSERT INTO messages (message_id, user_id, channel_id, text, status) VALUES ('1', ?, ?, 'x', 'new')",
+                     (USER_ID, CHANNEL))
+    conn.commit()
+    SQLite_database.run_migrations(conn)
+    assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,34 @@
+# tests/test_thresholds.py
+# Thresholds of the calibrated pre-filter picked from held-out (probability, label) pairs.
+import random
+from Prefilter_calibration import MIN_DECIDED, evaluate, pick_thresholds
+
+
+def test_separable_scores():
+    scored = [(i / 100, 0) for i in range(40)] + [(0.6 + i / 100, 1) for i in range(40)]
+    clean_below, ad_above = pick_thresholds(scored, max_error=0.0)
+    assert 0.39 < clean_below <= ad_above < 0.6
+    assert evaluate(scored, clean_below, ad_above) == (1.0, 0.0)
+
+
+def test_error_budget_is_respected():
+    rnd = random.Random(1)
+    scored = [(p, int(rnd.random() < p)) for p in (rnd.random() for _ in range(2000))]
+    for max_error in (0.01, 0.05, 0.2):
+        clean_below, ad_above = pick_thresholds(scored, max_error)
+        below = [label for p, label in scored if p < clean_below]
+        above = [1 - label for p, label in scored if p > ad_above]
+        assert sum(below) <= max_error * len(below)
+        assert sum(above) <= max_error * len(above)
+        assert clean_below <= ad_above
+
+
+def test_ties_are_not_split():
+    scored = [(0.1, 0)] * MIN_DECIDED + [(0.5, 0), (0.5, 1)] + [(0.9, 1)] * MIN_DECIDED
+    clean_below, ad_above = pick_thresholds(scored, max_error=0.0)
+    assert 0.1 < clean_below < 0.5 < ad_above < 0.9
+
+
+def test_too_few_samples_decide_nothing():
+    scored = [(0.1, 0)] * (MIN_DECIDED - 1) + [(0.9, 1)] * (MIN_DECIDED - 1)
+    assert pick_thresholds(scored, max_error=0.1) == (None, None)